@@ -0,0 +1,133 @@
+"""
+Per-row load cost of a 50 columns table with the SQL Server converters
+
+Rows are built in memory as pyodbc returns them (str, int, Decimal, datetime, rowversion bytes),
+no connection is opened: pyodbc must be installed, SQL Server is not needed.
+
+before: each value is converted by the chain of field type checks of from_sqlvalue, as done before
+        the converters were resolved once per field type
+after:  table_loadrow, converter of each field taken from the load plan of the dataset
+
+python benchmark/loadrow.py [rows]
+"""
+import os
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+import dateutil.tz
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core.session
+import core.database.server
+import core.database.sqlserver
+from core.object.table import Table
+from core.language import label
+from core import field
+from core.field.field import FieldType
+
+
+class Wide(Table):
+    def _init(self):
+        self._name = 'Benchmark Wide'
+        self.no = field.Code('No.', label('No.'), 20)
+        for i in range(1, 50):
+            if i % 5 == 0:
+                f = field.Code('Code ' + str(i), label('Code'), 20)
+            elif i % 5 == 1:
+                f = field.Text('Text ' + str(i), label('Text'), 50)
+            elif i % 5 == 2:
+                f = field.Decimal('Decimal ' + str(i), label('Decimal'))
+            elif i % 5 == 3:
+                f = field.Integer('Integer ' + str(i), label('Integer'))
+            else:
+                f = field.DateTime('DateTime ' + str(i), label('DateTime'))
+            setattr(self, 'f' + str(i), f)
+        self._setprimarykey(self.no)
+
+
+def from_sqlvalue(field, value):
+    # conversion of a value before the converters were resolved once per field type
+    res = None
+    if field.type in [FieldType.CODE, FieldType.TEXT, FieldType.INTEGER, FieldType.BIGINTEGER, FieldType.OPTION]:
+        res = value
+
+    elif field.type == FieldType.DECIMAL:
+        res = value.normalize()
+
+    elif field.type == FieldType.BOOLEAN:
+        res = True if value == 1 else False
+
+    elif field.type == FieldType.DATETIME:
+        if value == datetime(1753, 1, 1):
+            res = None
+        else:
+            value = value.replace(tzinfo=dateutil.tz.UTC)
+            res = value.astimezone(core.session.Session.timezone)
+
+    elif field.type == FieldType.DATE:
+        if value == datetime(1753, 1, 1):
+            res = None
+        else:
+            res = value.date()
+
+    elif field.type == FieldType.TIME:
+        if value == datetime(1753, 1, 1):
+            res = None
+        else:
+            res = value.time()
+
+    return res
+
+
+def load_before(table, dataset, plan, index):
+    row = dataset[index]
+    for f, i in plan:
+        f.value = from_sqlvalue(f, row[i])
+    table._rowversion = row[dataset.columns['timestamp']]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    db = core.database.sqlserver.SqlServer()
+    table = Wide()
+
+    columns = {}
+    for i, f in enumerate(table._fields):
+        columns[f.sqlname] = i
+    columns['timestamp'] = len(table._fields)
+
+    dataset = core.database.server.Dataset(columns)
+    for i in range(rows):
+        row = ['N' + str(i).zfill(8)]
+        for f in table._fields[1:]:
+            if f.type == FieldType.DECIMAL:
+                # decimal(38,20) columns
+                row.append((Decimal(i) / 100).quantize(Decimal(1).scaleb(-20)))
+            elif f.type == FieldType.INTEGER:
+                row.append(i)
+            elif f.type == FieldType.DATETIME:
+                row.append(datetime(2020, 1, 1 + i % 28))
+            else:
+                row.append('value ' + str(i))
+        row.append((i + 1).to_bytes(8, 'big'))
+        dataset.append(tuple(row))
+
+    # positions of the fields resolved once per dataset in both cases
+    plan = [(f, dataset.columns[f.sqlname]) for f in table._fields]
+    variants = [
+        ('before', lambda index: load_before(table, dataset, plan, index)),
+        ('after', lambda index: db.table_loadrow(table, dataset, index))
+    ]
+    for name, load in variants:
+        start = time.perf_counter()
+        for i in range(len(dataset)):
+            load(i)
+        elapsed = time.perf_counter() - start
+        print('{0:8} {1:8.2f} us/row ({2} rows, {3} columns)'.format(name, elapsed * 1000000 / len(dataset),
+                                                                      len(dataset), len(table._fields)))
+
+
+if __name__ == '__main__':
+    main()
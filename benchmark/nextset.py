@@ -0,0 +1,111 @@
+"""
+Keyset pagination (table_nextset) on a 4 fields primary key on the embedded SQLite database
+
+before:       OR of the AND groups of the key fields, k(k+1)/2 parameters
+leading:      range on the leading field plus the OR of the AND groups (SQL Server dialect)
+row values:   (a, b, c, d) > (?, ?, ?, ?) (SQLite dialect)
+
+python benchmark/nextset.py [rows] [pages]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core.application
+import core.database.dialect
+from core.session import Session
+from core.object.table import Table
+from core.language import label
+from core import field
+
+
+class Entry(Table):
+    def _init(self):
+        self._name = 'Benchmark Entry'
+        self.a = field.Code('A', label('A'), 10)
+        self.b = field.Integer('B', label('B'))
+        self.c = field.Code('C', label('C'), 10)
+        self.d = field.Integer('D', label('D'))
+        self.amount = field.Integer('Amount', label('Amount'))
+        self._setprimarykey(self.a, self.b, self.c, self.d)
+
+
+def keyset_before(dialect, names):
+    # predicate built before seek-friendly keysets
+    ors = []
+    for l in range(len(names), 0, -1):
+        ands = []
+        for j in range(0, l):
+            ands.append('(' + dialect.quote(names[j]) + ' ' + ('>' if j == (l - 1) else '=') + ' ?)')
+        ors.append('(' + ' AND '.join(ands) + ')')
+
+    pars = []
+    for l in range(len(names), 0, -1):
+        pars += names[0:l]
+    return '(' + ' OR '.join(ors) + ')', pars
+
+
+def keyset_node(dialect, names):
+    node = core.database.dialect.Keyset(names)
+    return dialect.render(node), dialect.keyset_names(node)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    size = 50
+
+    path = tempfile.mkdtemp()
+    core.application.Application.instance = {
+        'name': 'benchmark', 'path': path + os.sep, 'db_type': 'sqlite', 'db_name': 'benchmark',
+        'dataset_size': size, 'dataset_maxsize': 1000, 'db_debug': False, 'cache_interval': 60
+    }
+    Session.connect()
+    db = Session.database
+    table = Entry()
+    db.table_compile(table)
+
+    # 10 x 100 x 10 x (rows / 10000) keys
+    per = max(1, rows // 10000)
+    keys = [('A' + str(a), b, 'C' + str(c), d) for a in range(10) for b in range(100) for c in range(10)
+            for d in range(per)]
+    names = [f.sqlname for f in table._primarykey]
+    sql = 'INSERT INTO [' + table._sqlname + '] (' + ', '.join(['[' + n + ']' for n in names])
+    sql += ', [Amount], [timestamp]) VALUES (?, ?, ?, ?, ?, ?)'
+    db.execute('DELETE FROM [' + table._sqlname + ']')
+    db._conn.executemany(sql, [k + (i, i + 1) for i, k in enumerate(keys)])
+    db.commit()
+    print('{0} rows, pages of {1} rows from {2} random keys'.format(len(keys), size, pages))
+
+    random.seed(1)
+    starts = random.sample(keys, pages)
+
+    variants = [
+        ('before', keyset_before(db.dialect, names)),
+        ('leading', keyset_node(core.database.dialect.Dialect(), names)),
+        ('row values', keyset_node(core.database.dialect.SqliteDialect(), names))
+    ]
+    for name, (where, binding) in variants:
+        sql = 'SELECT * FROM [' + table._sqlname + '] WHERE ' + where
+        sql += ' ORDER BY ' + ', '.join(['[' + n + ']' for n in names]) + ' LIMIT ' + str(size)
+
+        plan = db.query('EXPLAIN QUERY PLAN ' + sql, [None] * len(binding))
+        start = time.perf_counter()
+        for key in starts:
+            values = dict(zip(names, key))
+            db.query_dataset(sql, [values[n] for n in binding])
+        elapsed = time.perf_counter() - start
+        plan = '; '.join([r['detail'] for r in plan])
+        print('{0:12} {1:10.3f} ms/page  {2}'.format(name, elapsed * 1000 / pages, plan))
+
+    db.commit()
+    db.disconnect()
+    shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
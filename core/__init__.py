@@ -12,6 +12,7 @@ from core.object.codeunit import Codeunit
 from core.field.field import FieldType, FilterLevels
 from core import field
 from core.object.table import Table
+from core.object.query import Query
 from core.object.page import Page
 from core.control.icon import Icon
 from core import control
@@ -12,6 +12,8 @@ from core.app import AppInfo
 import core
 import core.language
 import core.object.table
+import core.database.server
+import core.database.factory
 import core.webserver
 from core.utility.convert import Convert
 import core.utility.proxy
@@ -24,6 +26,7 @@ class Application:
     """
     _cli_loglevel = []
     _log_lock = multiprocessing.Lock()
+    _cache_versions = None  # type: multiprocessing.Array
     _thd_check = None
     _thd_check_exit = False
 
@@ -80,6 +83,8 @@ class Application:
             Application._assert_default(opts, 'db_debug', False)
             Application._assert_default(opts, 'ws_debug', False)
             Application._assert_default(opts, 'dataset_size', 50)
+            Application._assert_default(opts, 'dataset_maxsize', 1000)
+            Application._assert_default(opts, 'cache_interval', 60)
             Application._assert_default(opts, 'webserver_enabled', False)
             Application._assert_default(opts, 'webserver_port', 8080)
             Application._assert_default(opts, 'webserver_secure', False)
@@ -182,9 +187,39 @@ class Application:
         Application.log(context, 'E', message)
 
     @staticmethod
-    def synchronize_schema():
+    def _compile_table(database: core.database.server.Server, tabclass, catalog, check):
+        """
+        Synchronize a table on the database connection, returns False on errors
+        """
+        try:
+            start = datetime.now()
+            tab = tabclass()
+            plan = database.table_compile(tab, catalog, check)
+            if check:
+                for sql, disruptive in plan:
+                    Application.log('syncschem', 'W' if disruptive else 'I', sql)
+
+            elif plan:
+                database.commit()
+                Application.log('syncschem', 'I', core.language.label('Table \'{0}\' synchronized in {1}'.format(
+                    tab._caption, datetime.now() - start)))
+
+            return True
+
+        except:
+            Application.logexception('syncschem')
+            try:
+                database.rollback()
+            except:
+                pass
+            return False
+
+    @staticmethod
+    def synchronize_schema(check=False, parallelism=1):
         """
         Synchronize database schema in the current instance
+        In check mode the statements are logged without being executed
+        With parallelism > 1 tables are distributed on multiple connections
         """
         res = True
         try:        
@@ -195,16 +230,65 @@ class Application:
             if not os.path.isfile(fn):
                 return True
 
+            catalog = Session.database.schema_snapshot()
+
+            tables = []
             mod = importlib.import_module('app.table')
             for name, obj in inspect.getmembers(mod):
                 if inspect.isclass(obj) and issubclass(obj, core.object.table.Table) and (obj.__module__ == 'app.table'):
+                    tables.append(obj)
+
+            # SQLite serializes writers, and each connection to :memory: opens another database
+            if Application.instance['db_type'] == 'sqlite':
+                parallelism = 1
+
+            if check or (parallelism <= 1):
+                for obj in tables:
+                    if not Application._compile_table(Session.database, obj, catalog, check):
+                        res = False
+
+            else:
+                # the catalog read must not hold the session transaction while workers alter tables,
+                # workers use only their own connection and leave the session to this thread
+                Session.database.commit()
+                lock = threading.Lock()
+                results = []
+
+                def worker():
                     try:
-                        tab = obj()
-                        Session.database.table_compile(tab)
-                        Session.database.commit()
+                        database = core.database.factory.ServerFactory.CreateServer(Application.instance)
+                        database.connect()
                     except:
-                        Application.logexception('syncschem') 
-                        res = False           
+                        Application.logexception('syncschem')
+                        return
+
+                    try:
+                        while True:
+                            with lock:
+                                if not tables:
+                                    break
+                                obj = tables.pop(0)
+
+                            ok = Application._compile_table(database, obj, catalog, False)
+                            with lock:
+                                results.append(ok)
+                    finally:
+                        database.disconnect()
+
+                threads = []
+                for i in range(min(parallelism, len(tables))):
+                    thd = threading.Thread(target=worker)
+                    thd.start()
+                    threads.append(thd)
+
+                for thd in threads:
+                    thd.join()
+
+                # tables left by workers unable to connect
+                if tables or (not all(results)):
+                    res = False
+
+            Session.database.commit()
 
         except:
             Application.logexception('syncschem')
@@ -234,6 +318,9 @@ class Application:
         Start servers and process pools
         """
         try:
+            # versions of the _cached tables, shared with the worker processes
+            Application._cache_versions = multiprocessing.Array('q', 1024)
+
             Session.connect()
             core.utility.proxy.Proxy.su_invoke('app.codeunit.SessionManagement', 'server_start')
 
@@ -49,6 +49,7 @@ class Field(Control):
             tab = rel['to']()
 
             schema = self._page._getschema(tab._dropdown)
+            tab.setloadfields(*tab._dropdown)
             if rel['filters']:
                 rel['filters'](tab)
 
@@ -0,0 +1,168 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict
+
+
+class StatementCache:
+    """
+    Statements built by the session by shape (table, operation, filters...), the least recently used
+    are dropped beyond size
+    """
+    def __init__(self, size=1000):
+        self.size = size
+        self._entries = OrderedDict()  # type: Dict[tuple, object]
+
+    def get(self, key):
+        stmt = self._entries.get(key)
+        if stmt is not None:
+            self._entries.move_to_end(key)
+        return stmt
+
+    def __setitem__(self, key, stmt):
+        self._entries[key] = stmt
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RecordCache:
+    """
+    Datasets read by primary key in the session, for tables with _pkcache
+    Entries of tables with _pkcache_validate are kept across transactions (checked against rowversion on use),
+    the others are dropped at the end of the transaction
+    """
+    def __init__(self, size=1000):
+        self.size = size  # entries per table
+        self._tables = {}  # type: Dict[type, Dict[tuple, list]]
+        self._validate = {}  # type: Dict[type, bool]
+
+    @staticmethod
+    def getkey(pk):
+        """
+        Returns the cache key of primary key values, text is compared case insensitive as in the database
+        """
+        return tuple(v.upper() if isinstance(v, str) else v for v in pk)
+
+    def get(self, tableclass, key):
+        entries = self._tables.get(tableclass)
+        if entries is None:
+            return None
+        return entries.get(key)
+
+    def put(self, tableclass, key, dataset, validate):
+        entries = self._tables.get(tableclass)
+        if entries is None:
+            entries = {}
+            self._tables[tableclass] = entries
+        self._validate[tableclass] = validate
+
+        if (key not in entries) and (len(entries) >= self.size):
+            del entries[next(iter(entries))]
+        entries[key] = dataset
+
+    def invalidate(self, tableclass, key=None):
+        """
+        Remove one record (or all records, without key) of a table
+        """
+        entries = self._tables.get(tableclass)
+        if entries is None:
+            return
+
+        if key is None:
+            entries.clear()
+        else:
+            entries.pop(key, None)
+
+    def commit(self):
+        for tableclass in self._tables:
+            if not self._validate[tableclass]:
+                self._tables[tableclass].clear()
+
+    def clear(self):
+        self._tables.clear()
+
+
+class TableCache:
+    """
+    Snapshots of the tables declared with _cached, loaded once by each process
+    The versions of the tables are shared by all processes (slot by table name): a process committing changes
+    to a table increments its version, the snapshots of the other processes are reloaded on next use
+    Changes made outside Core are detected comparing rows count and max rowversion every interval seconds
+    Without shared versions (no worker processes, e.g. cli) the versions are kept by the process
+    """
+    _local_versions = [0] * 1024
+    _local_lock = threading.Lock()
+
+    def __init__(self, versions=None, interval=60):
+        self.versions = versions if versions is not None else TableCache._local_versions  # multiprocessing.Array
+        self._lock = versions.get_lock() if versions is not None else TableCache._local_lock
+        self.interval = interval
+        self._snapshots = {}  # type: Dict[str, dict]
+        self._changed = set()
+
+    def _slot(self, sqlname):
+        return zlib.crc32(sqlname.encode('utf-8')) % len(self.versions)
+
+    def version(self, sqlname):
+        return self.versions[self._slot(sqlname)]
+
+    def get(self, sqlname):
+        """
+        Returns the snapshot of the table, None if missing or outdated
+        """
+        snap = self._snapshots.get(sqlname)
+        if snap is None:
+            return None
+
+        if snap['version'] != self.version(sqlname):
+            del self._snapshots[sqlname]
+            return None
+
+        return snap
+
+    def put(self, sqlname, version, mark, dataset, index):
+        snap = {
+            'version': version,
+            'mark': mark,
+            'checked': time.monotonic(),
+            'dataset': dataset,
+            'index': index
+        }
+        self._snapshots[sqlname] = snap
+        return snap
+
+    def tocheck(self, snap):
+        """
+        Returns True if the mark of the snapshot has to be compared with the database
+        """
+        return time.monotonic() - snap['checked'] >= self.interval
+
+    def ischanged(self, sqlname):
+        """
+        Returns True if the table has been changed by the current transaction
+        """
+        return sqlname in self._changed
+
+    def change(self, sqlname):
+        self._changed.add(sqlname)
+        self._snapshots.pop(sqlname, None)
+
+    def commit(self):
+        """
+        Notify the changes of the transaction to all processes, to be called after commit
+        """
+        if not self._changed:
+            return
+
+        with self._lock:
+            for sqlname in self._changed:
+                self.versions[self._slot(sqlname)] += 1
+        self._changed.clear()
+
+    def rollback(self):
+        self._changed.clear()
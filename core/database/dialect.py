@@ -0,0 +1,409 @@
+from typing import List
+import core.field.field
+
+
+class Node:
+    """
+    Base node of the statement tree, rendered to SQL by a Dialect
+    Parameters are always rendered as ? in the order the nodes are visited
+    """
+
+
+class Raw(Node):
+    """
+    SQL fragment rendered as is
+    """
+    def __init__(self, sql, alias=None):
+        self.sql = sql
+        self.alias = alias
+
+
+class Column(Node):
+    """
+    Column reference, optionally qualified by prefix (inserted, src...) and aliased in the select list
+    """
+    def __init__(self, name, prefix='', alias=None):
+        self.name = name
+        self.prefix = prefix
+        self.alias = alias
+
+
+class Aggregate(Node):
+    """
+    Aggregate function of a column node (SUM, MIN, MAX, AVG, COUNT), optionally aliased in the select list
+    """
+    def __init__(self, function, argument: Node, alias=None):
+        self.function = function
+        self.argument = argument
+        self.alias = alias
+
+
+class Compare(Node):
+    """
+    Comparison of a column with a parameter
+    left replaces the column name with another node (qualified column, function)
+    """
+    def __init__(self, name, op='=', left: Node = None):
+        self.name = name
+        self.op = op
+        self.left = left
+
+
+class Between(Node):
+    """
+    Column between two parameters
+    """
+    def __init__(self, name, left: Node = None):
+        self.name = name
+        self.left = left
+
+
+class Expression(Node):
+    """
+    Filter expression of a field (see FieldFilter.tosql)
+    """
+    def __init__(self, fieldfilter: core.field.field.FieldFilter, left: Node = None):
+        self.fieldfilter = fieldfilter
+        self.left = left
+
+
+class Equal(Node):
+    """
+    Comparison of two nodes (join condition)
+    """
+    def __init__(self, left: Node, right: Node):
+        self.left = left
+        self.right = right
+
+
+class Keyset(Node):
+    """
+    Rows following (or preceding, if descending) the parameters in the order of the columns
+    """
+    def __init__(self, names: List[str], descending=False):
+        self.names = names
+        self.descending = descending
+
+
+class And(Node):
+    def __init__(self, *items: Node):
+        self.items = list(items)
+
+
+class Or(Node):
+    def __init__(self, *items: Node):
+        self.items = list(items)
+
+
+class Join(Node):
+    """
+    Table joined by a select, rendered as part of the FROM clause
+    """
+    def __init__(self, table, alias, on: List[Node], outer=False):
+        self.table = table
+        self.alias = alias
+        self.on = on
+        self.outer = outer
+
+
+class Select(Node):
+    """
+    Select statement
+    lock: 'update' to lock the rows read, 'nolock' to read uncommitted rows, None for default
+    limit: number of rows (int) or True to bind offset and size as parameters
+    """
+    def __init__(self, table, columns: List[Node], where: List[Node] = None, orderby: List[tuple] = None,
+                 lock=None, limit=None, alias=None):
+        self.table = table
+        self.columns = columns
+        self.where = where if where is not None else []
+        self.orderby = orderby if orderby is not None else []  # (name or node, descending)
+        self.lock = lock
+        self.limit = limit
+        self.alias = alias
+        self.joins = []  # type: List[Join]
+        self.groupby = []  # type: List[Node]
+        self.having = []  # type: List[Node]
+
+
+class Insert(Node):
+    """
+    Insert statement of one or more rows of parameters, output returns the listed columns of new rows
+    """
+    def __init__(self, table, columns: List[str], rows=1, output: List[str] = None):
+        self.table = table
+        self.columns = columns
+        self.rows = rows
+        self.output = output if output is not None else []
+
+
+class Update(Node):
+    """
+    Update statement setting the columns to parameters, output returns the listed columns of updated rows
+    """
+    def __init__(self, table, columns: List[str], where: List[Node] = None, output: List[str] = None):
+        self.table = table
+        self.columns = columns
+        self.where = where if where is not None else []
+        self.output = output if output is not None else []
+
+
+class Delete(Node):
+    """
+    Delete statement, output returns the listed columns of deleted rows
+    """
+    def __init__(self, table, where: List[Node] = None, output: List[str] = None):
+        self.table = table
+        self.where = where if where is not None else []
+        self.output = output if output is not None else []
+
+
+class Dialect:
+    """
+    Render the statement tree in standard SQL, subclassed by each database
+    """
+    def quote(self, name):
+        return '[' + name + ']'
+
+    def render(self, node: Node):
+        return getattr(self, '_render_' + node.__class__.__name__.lower())(node)
+
+    def _render_list(self, nodes: List[Node]):
+        return ', '.join([self.render(n) for n in nodes])
+
+    def _render_names(self, names: List[str], prefix=''):
+        return ', '.join([prefix + self.quote(n) for n in names])
+
+    def _render_where(self, where: List[Node], clause=' WHERE '):
+        # top level predicates are joined by AND
+        res = [self.render(n) for n in where]
+        res = [r for r in res if r]
+        if not res:
+            return ''
+        return clause + ' AND '.join(res)
+
+    def _render_raw(self, node: Raw):
+        if node.alias:
+            return node.sql + ' AS ' + self.quote(node.alias)
+        return node.sql
+
+    def _render_column(self, node: Column):
+        sql = node.prefix + self.quote(node.name)
+        if node.alias:
+            sql += ' AS ' + self.quote(node.alias)
+        return sql
+
+    def _render_aggregate(self, node: Aggregate):
+        sql = node.function + '(' + self.render(node.argument) + ')'
+        if node.alias:
+            sql += ' AS ' + self.quote(node.alias)
+        return sql
+
+    def _render_left(self, node):
+        if node.left is not None:
+            return self.render(node.left)
+        return self.quote(node.name)
+
+    def _render_compare(self, node: Compare):
+        return '(' + self._render_left(node) + ' ' + node.op + ' ?)'
+
+    def _render_between(self, node: Between):
+        return '(' + self._render_left(node) + ' BETWEEN ? AND ?)'
+
+    def _render_expression(self, node: Expression):
+        flt = node.fieldfilter
+        if node.left is not None:
+            left = self.render(node.left)
+        else:
+            left = self.quote(flt.field.sqlname)
+        return flt.tosql([], left_name=left)
+
+    def _render_equal(self, node: Equal):
+        return '(' + self.render(node.left) + ' = ' + self.render(node.right) + ')'
+
+    def keyset_names(self, node: Keyset):
+        """
+        Returns the columns of the keyset parameters, in binding order
+        """
+        if len(node.names) == 1:
+            return list(node.names)
+
+        res = [node.names[0]]
+        for l in range(len(node.names), 0, -1):
+            res += node.names[0:l]
+        return res
+
+    def _render_keyset(self, node: Keyset):
+        op = '<' if node.descending else '>'
+        if len(node.names) == 1:
+            return '(' + self.quote(node.names[0]) + ' ' + op + ' ?)'
+
+        # the range on the leading column is redundant, but allows an index seek
+        ors = []
+        for l in range(len(node.names), 0, -1):
+            ands = []
+            for j in range(0, l):
+                ands.append('(' + self.quote(node.names[j]) + ' ' + (op if j == (l - 1) else '=') + ' ?)')
+            ors.append(ands[0] if len(ands) == 1 else '(' + ' AND '.join(ands) + ')')
+
+        res = '(' + self.quote(node.names[0]) + ' ' + op + '= ?)'
+        return '(' + res + ' AND (' + ' OR '.join(ors) + '))'
+
+    def _render_and(self, node: And):
+        return self._render_join(node.items, ' AND ')
+
+    def _render_or(self, node: Or):
+        return self._render_join(node.items, ' OR ')
+
+    def _render_join(self, items: List[Node], op):
+        res = [self.render(n) for n in items]
+        res = [r for r in res if r]
+        if not res:
+            return ''
+        if len(res) == 1:
+            return res[0]
+        return '(' + op.join(res) + ')'
+
+    def _render_orderby(self, node: Select):
+        if not node.orderby:
+            return ''
+
+        res = []
+        for name, descending in node.orderby:
+            sql = self.render(name) if isinstance(name, Node) else self.quote(name)
+            res.append(sql + (' DESC' if descending else ''))
+        return ' ORDER BY ' + ', '.join(res)
+
+    def _render_from(self, node: Select):
+        sql = ' FROM ' + self.quote(node.table)
+        if node.alias:
+            sql += ' AS ' + self.quote(node.alias)
+        sql += self._render_hint(node)
+
+        for join in node.joins:
+            sql += ' LEFT JOIN ' if join.outer else ' INNER JOIN '
+            sql += self.quote(join.table) + ' AS ' + self.quote(join.alias) + self._render_hint(node)
+            sql += ' ON ' + self._render_join(join.on, ' AND ')
+        return sql
+
+    def _render_groupby(self, node: Select):
+        sql = ''
+        if node.groupby:
+            sql += ' GROUP BY ' + self._render_list(node.groupby)
+        sql += self._render_where(node.having, ' HAVING ')
+        return sql
+
+    def _render_hint(self, node: Select):
+        return ''
+
+    def _render_top(self, node: Select):
+        return ''
+
+    def _render_limit(self, node: Select):
+        return ''
+
+    def _render_select(self, node: Select):
+        sql = 'SELECT ' + self._render_top(node) + self._render_list(node.columns)
+        sql += self._render_from(node)
+        sql += self._render_where(node.where)
+        sql += self._render_groupby(node)
+        sql += self._render_orderby(node)
+        sql += self._render_limit(node)
+        return sql
+
+    def _render_output(self, output: List[str], prefix='inserted.'):
+        return ''
+
+    def _render_returning(self, output: List[str]):
+        return ''
+
+    def _render_insert(self, node: Insert):
+        sql = 'INSERT INTO ' + self.quote(node.table) + ' (' + self._render_names(node.columns) + ')'
+        sql += self._render_output(node.output)
+        sql += ' VALUES ' + ', '.join(['(' + ', '.join(['?'] * len(node.columns)) + ')'] * node.rows)
+        sql += self._render_returning(node.output)
+        return sql
+
+    def _render_update(self, node: Update):
+        sql = 'UPDATE ' + self.quote(node.table) + ' SET '
+        sql += ', '.join([self.quote(n) + ' = ?' for n in node.columns])
+        sql += self._render_output(node.output)
+        sql += self._render_where(node.where)
+        sql += self._render_returning(node.output)
+        return sql
+
+    def _render_delete(self, node: Delete):
+        sql = 'DELETE FROM ' + self.quote(node.table)
+        sql += self._render_output(node.output, 'deleted.')
+        sql += self._render_where(node.where)
+        sql += self._render_returning(node.output)
+        return sql
+
+
+class SqlServerDialect(Dialect):
+    """
+    Transact-SQL: table hints, TOP, OFFSET ... FETCH and OUTPUT clause
+    """
+    def _render_hint(self, node: Select):
+        if node.lock == 'update':
+            return ' WITH (UPDLOCK)'
+        elif node.lock == 'nolock':
+            return ' WITH (READUNCOMMITTED)'
+        return ''
+
+    def _render_top(self, node: Select):
+        if isinstance(node.limit, int) and not isinstance(node.limit, bool):
+            return 'TOP ' + str(node.limit) + ' '
+        return ''
+
+    def _render_limit(self, node: Select):
+        if node.limit is True:
+            return ' OFFSET ? ROWS FETCH FIRST ? ROWS ONLY'
+        return ''
+
+    def _render_orderby(self, node: Select):
+        if (not node.orderby) and (node.limit is True):
+            # OFFSET ... FETCH requires ORDER BY (single row of aggregates)
+            return ' ORDER BY (SELECT NULL)'
+        return super()._render_orderby(node)
+
+    def _render_output(self, output: List[str], prefix='inserted.'):
+        if not output:
+            return ''
+        return ' OUTPUT ' + self._render_names(output, prefix)
+
+
+class SqliteDialect(Dialect):
+    """
+    SQLite: no table hints, LIMIT and RETURNING clause
+    """
+    def _render_limit(self, node: Select):
+        if node.limit is True:
+            # offset before size, as SQL Server
+            return ' LIMIT ?, ?'
+        elif node.limit is not None:
+            return ' LIMIT ' + str(node.limit)
+        return ''
+
+    def _render_returning(self, output: List[str]):
+        if not output:
+            return ''
+        return ' RETURNING ' + self._render_names(output)
+
+    def _render_aggregate(self, node: Aggregate):
+        sql = super()._render_aggregate(node)
+        if (not node.alias) and (node.function in ['SUM', 'AVG']):
+            # compared with parameters: numeric affinity as the columns (decimals are bound as text)
+            sql = 'CAST(' + sql + ' AS NUMERIC)'
+        return sql
+
+    def keyset_names(self, node: Keyset):
+        return list(node.names)
+
+    def _render_keyset(self, node: Keyset):
+        # row values comparison, resolved by SQLite with a seek on the index
+        op = '<' if node.descending else '>'
+        if len(node.names) == 1:
+            return '(' + self.quote(node.names[0]) + ' ' + op + ' ?)'
+
+        return '((' + self._render_names(node.names) + ') ' + op + ' (' + ', '.join(['?'] * len(node.names)) + '))'
@@ -1,19 +1,25 @@
 import core.database.server
-import core.database.sqlserver
 from core.language import label
 
 
 class ServerFactory:
     @staticmethod
     def CreateServer(instance) -> core.database.server.Server:
+        # drivers are imported on demand, so only the one in use has to be installed
         if instance['db_type'] == 'sqlserver':
+            import core.database.sqlserver
             res = core.database.sqlserver.SqlServer()
+        elif instance['db_type'] == 'sqlite':
+            import core.database.sqlite
+            res = core.database.sqlite.Sqlite()
         else:
             raise Exception(label('Unsupported database type \'{0}\''.format(instance['db_type'])))
 
-        res.host = instance['db_host']
-        res.login = instance['db_login']
-        res.password = instance['db_password']
+        res.host = instance.get('db_host', '')
+        res.login = instance.get('db_login', '')
+        res.password = instance.get('db_password', '')
         res.db_name = instance['db_name']
         res.dataset_size = instance['dataset_size']
-        return res
\ No newline at end of file
+        res.dataset_maxsize = instance['dataset_maxsize']
+        res.tablecache.interval = instance['cache_interval']
+        return res
@@ -1,8 +1,53 @@
+import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
 import core.object.table
+import core.object.query
 import core.field.field
 import core.session
 import core.application
+import core.database.dialect
+import core.database.cache
+from core.language import label
+from core.field.field import FieldType
+
+
+class Statement:
+    """
+    Cached SQL statement with the binding plan of its parameters
+    """
+    def __init__(self, sql, fields: List[int] = None):
+        self.sql = sql
+        self.fields = fields if fields is not None else []  # position in table._fields of each bound field
+
+
+class Dataset(list):
+    """
+    Rows of a result set as tuples, sharing a single column index map
+    """
+    def __init__(self, columns: Dict[str, int] = None):
+        super().__init__()
+        self.columns = columns if columns is not None else {}  # type: Dict[str, int]
+        self.plan = None  # type: List[tuple]
+        self.skipped = []  # type: List[core.field.field.Field]
+        self.cursor = None  # open cursor of a streamed result set
+        self.prefetch = None  # (future, size, _writeseq) of the next dataset read ahead
+
+    def getplan(self, table: core.object.table.Table, converters: dict):
+        """
+        Returns position and converter of each table field in the rows, computed once per result set
+        Fields not selected by the query are collected in skipped
+        """
+        if self.plan is None:
+            self.plan = []
+            for field in table._fields:
+                if field.sqlname in self.columns:
+                    self.plan.append((field, self.columns[field.sqlname], converters[field.type]))
+                else:
+                    self.skipped.append(field)
+
+        return self.plan
 
 
 class Server:
@@ -15,9 +60,27 @@ class Server:
         self.password = ''
         self.db_name = ''
         self.dataset_size = 0
+        self.dataset_maxsize = 0
         self._stmtstart = None
         self._stmtsql = None
         self._stmtpars = None
+        self._statements = core.database.cache.StatementCache()
+        self._fromsql = None
+        self._fromsql_tz = None
+        self._tosql = {}  # type: Dict[int, Callable]
+        self._max_parameters = 2000  # parameters per statement
+        self._max_rows = 1000  # rows (or OR predicates) per statement
+        self.dialect = core.database.dialect.Dialect()
+        self._stream = None  # type: Dataset
+        self._writeseq = 0  # statements other than SELECT executed
+        self._writeseq_tx = 0  # _writeseq at the end of last transaction
+        self._can_prefetch = True
+        self._prefetcher = None  # type: ThreadPoolExecutor
+        self._prefetch_db = None  # type: Server
+        self.cache = core.database.cache.RecordCache()
+        self.tablecache = core.database.cache.TableCache(core.application.Application._cache_versions)
+        self._buffer = {}  # type: Dict[str, dict]
+        self._flushing = False
 
     def connect(self):
         """
@@ -59,24 +122,85 @@ class Server:
         Execute a query and returns all rows within a list of dict, key = field name, value = field value
         """
 
+    def query_dataset(self, sql, parameters: list = None, stream=False, size=None) -> Dataset:
+        """
+        Execute a query and returns all rows as tuples within a Dataset
+        In stream mode returns the first size (default dataset_size) rows, keeping the cursor open in the Dataset
+        """
+
+    def dataset_nextsize(self, size):
+        """
+        Size of the set following one of size rows: grows geometrically up to dataset_maxsize as a read loop goes on
+        """
+        if size <= 0:
+            return self.dataset_size
+        else:
+            return max(size, min(size * 4, self.dataset_maxsize))
+
     def table_isempty(self, table: core.object.table.Table):
         """
         Returns true if the table is empty with current filters
         """
+        node = core.database.dialect.Select(table._sqlname, [core.database.dialect.Raw('1', 'ne')], lock='nolock', limit=1)
+        stmt, pars = self._get_filtered(table, 'isempty', node)
+
+        if not self.query(stmt.sql, pars):
+            return True
+        else:
+            return False
 
     def table_count(self, table: core.object.table.Table):
         """
         Returns the total number of rows
         """
+        node = core.database.dialect.Select(table._sqlname, [core.database.dialect.Raw('COUNT(*)', 'c')], lock='nolock')
+        stmt, pars = self._get_filtered(table, 'count', node)
+
+        qry = self.query(stmt.sql, pars)
+        return qry[0]['c']
+
+    def table_calcfields(self, table: core.object.table.Table, function, fields: list):
+        """
+        Set fields value with the aggregate function (SUM, MIN, MAX, AVG) on the rows matching the current filter
+        """
+        columns = [core.database.dialect.Aggregate(function, core.database.dialect.Column(field.sqlname), field.sqlname)
+                   for field in fields]
+        node = core.database.dialect.Select(table._sqlname, columns, lock='nolock')
+
+        op = (function, tuple(field.sqlname for field in fields))
+        stmt, pars = self._get_filtered(table, op, node)
+
+        row = self.query_dataset(stmt.sql, pars)[0]
+        fromsql = self._get_fromsql()
+        for i, field in enumerate(fields):
+            if row[i] is None:
+                field.value = field.initvalue
+            else:
+                field.value = fromsql[field.type](row[i])
 
     def table_deleteall(self, table: core.object.table.Table):
         """
         Delete all record matching the current filter
         """
+        node = core.database.dialect.Delete(table._sqlname)
+        stmt, pars = self._get_filtered(table, 'deleteall', node)
+
+        self.execute(stmt.sql, pars)
 
-    def table_compile(self, table: core.object.table.Table):
+    def table_modifyall(self, table: core.object.table.Table, field: core.field.field.Field, value):
         """
-        Compile a table and its dependencies on database
+        Set the field to the value in all records matching the current filter
+        """
+
+    def schema_snapshot(self, tablename=None):
+        """
+        Read the catalog of all tables (or only tablename) from the database: columns, primary key and indexes
+        """
+
+    def table_compile(self, table: core.object.table.Table, catalog: dict = None, check=False):
+        """
+        Compile a table and its dependencies on database comparing it with the catalog (schema_snapshot)
+        Returns the plan as list of (statement, disruptive), in check mode the plan is not executed
         """        
 
     def table_insert(self, table: core.object.table.Table):
@@ -84,44 +208,874 @@ class Server:
         Insert a record in the database
         """
 
+    def table_insertall(self, table: core.object.table.Table, records: list):
+        """
+        Insert a list of records in the database in batches
+        """
+
     def table_modify(self, table: core.object.table.Table):
         """
         Modify a record in the database
         """
 
+    def table_modifyrows(self, table: core.object.table.Table, records: list):
+        """
+        Modify a list of records of the table (write buffer flush)
+        """
+        for rec in records:
+            self.table_modify(rec)
+
+    def buffer_insert(self, table: core.object.table.Table):
+        """
+        Collect the insert of the record in the write buffer, records with autoincrement are inserted at once
+        """
+        if self._get_identity(table) is not None:
+            self.flush(table)
+            self.table_insert(table)
+            return
+
+        entries = self._buffer.setdefault(table._sqlname, {})
+        key = self.cache.getkey(table.getposition())
+        if key in entries:
+            table._error_duplicate()
+
+        entries[key] = {'insert': True, 'record': table._clone(), 'source': table}
+        self._buffer_check(table)
+
+    def buffer_modify(self, table: core.object.table.Table):
+        """
+        Collect the modify of the record in the write buffer, merged with the pending insert or modify of the record
+        """
+        entries = self._buffer.setdefault(table._sqlname, {})
+        key = self.cache.getkey(table.getposition())
+        entry = entries.get(key)
+        if entry is None:
+            entries[key] = {'insert': False, 'record': table._clone(), 'source': table}
+            self._buffer_check(table)
+        else:
+            for field, other in zip(entry['record']._fields, table._fields):
+                field.__dict__['value'] = other.value
+
+    def _buffer_check(self, table: core.object.table.Table):
+        """
+        Write the buffered records of the table once they fill a batch (long loops, streams not flushed by reads)
+        """
+        if len(self._buffer[table._sqlname]) >= self._max_rows:
+            self._flush(table._sqlname)
+
+    def flush(self, table: core.object.table.Table = None):
+        """
+        Write the records collected in the write buffer (all or of the table only)
+        """
+        if table is not None:
+            self._flush(table._sqlname)
+        else:
+            for sqlname in list(self._buffer):
+                self._flush(sqlname)
+
+    def _flush(self, sqlname):
+        """
+        Write the buffered records of a table, they leave the buffer only once written
+        """
+        entries = self._buffer.get(sqlname)
+        if not entries:
+            return
+
+        self._flushing = True
+        try:
+            for insert in [True, False]:
+                keys = [key for key, entry in entries.items() if entry['insert'] == insert]
+                if not keys:
+                    continue
+
+                records = [entries[key]['record'] for key in keys]
+                if insert:
+                    self.table_insertall(records[0], records)
+                else:
+                    self.table_modifyrows(records[0], records)
+
+                for key in keys:
+                    entry = entries.pop(key)
+                    rec = entry['record']
+                    rec._accept_changes()
+                    # the source may hold another record meanwhile (read loop)
+                    if entry['source'].getposition() == rec.getposition():
+                        entry['source']._rowversion = rec._rowversion
+        finally:
+            self._flushing = False
+
+        self._buffer.pop(sqlname, None)
+
+    def _flush_commit(self):
+        """
+        Flush the write buffer before commit, rolling back on errors
+        """
+        try:
+            self.flush()
+        except:
+            self._buffer.clear()
+            self.rollback()
+            raise
+
     def table_delete(self, table: core.object.table.Table):
         """
         Delete a record in the database
-        """        
+        """
+        key = (table.__class__, 'delete')
+        stmt = self._statements.get(key)
+        if stmt is None:
+            node = core.database.dialect.Delete(table._sqlname, [self._get_wherepk(table)])
+            stmt = Statement(self.dialect.render(node))
+            self._statements[key] = stmt
+
+        pars = []
+        self._bind_wherepk(table, pars)
 
-    def table_findset(self, table: core.object.table.Table, size=None, offset=None):
+        n = self.execute(stmt.sql, pars)
+        if n != 1:
+            table._error_concurrency()
+
+    def table_deleterows(self, table: core.object.table.Table, rows: list):
+        """
+        Delete a list of records identified by primary key and rowversion
+        """
+        batch_size = min(self._max_rows, self._max_parameters // (len(table._primarykey) + 1))
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+
+            key = (table.__class__, 'deleterows', len(batch))
+            stmt = self._statements.get(key)
+            if stmt is None:
+                where = core.database.dialect.Or(*[self._get_wherepk(table) for _ in batch])
+                node = core.database.dialect.Delete(table._sqlname, [where],
+                                                    [field.sqlname for field in table._primarykey])
+                stmt = Statement(self.dialect.render(node))
+                self._statements[key] = stmt
+
+            pars = []
+            for pk, rowversion in batch:
+                i = 0
+                for field in table._primarykey:
+                    pars.append(self._tosql[field.type](pk[i]))
+                    i += 1
+                pars.append(rowversion)
+
+            # deleted rows are returned by primary key, the missing ones were changed by other users
+            fromsql = self._get_fromsql()
+            deleted = set()
+            for row in self.query_dataset(stmt.sql, pars):
+                deleted.add(tuple([fromsql[field.type](value) for field, value in zip(table._primarykey, row)]))
+            if len(deleted) != len(batch):
+                table._error_concurrency([pk for pk, rowversion in batch if tuple(pk) not in deleted])
+
+    def table_findset(self, table: core.object.table.Table, size=None, offset=None, stream=False) -> Dataset:
         """
         Select dataset from the database
+        In stream mode a single query is executed, the following rows are fetched by table_nextset
         """
+        return self._table_findset(table=table, size=size, offset=offset, stream=stream)
 
-    def table_nextset(self, table: core.object.table.Table):
+    def table_nextset(self, table: core.object.table.Table, size=None) -> Dataset:
         """
         Select next dataset from the database (pagination)
         """
+        dataset = table._dataset
+        if (dataset is not None) and (dataset.cursor is not None):
+            return self._stream_next(dataset, size)
+
+        if (dataset is not None) and (dataset.prefetch is not None):
+            res = self._prefetch_result(dataset, size)
+            if res is not None:
+                return res
+
+        return self._table_findset(table=table, nextset=True, size=size)
+
+    def table_prefetch(self, table: core.object.table.Table, size=None):
+        """
+        Start reading ahead the dataset following the current one on a second connection
+        Skipped if the transaction has pending changes, not visible to the other connection
+        """
+        if (not self._can_prefetch) or (self._writeseq != self._writeseq_tx):
+            return
+
+        dataset = table._dataset
+        sql, pars = self._prepare_findset(table=table, nextset=True, size=size, lastrow=dataset)
+
+        if self._prefetcher is None:
+            self._prefetcher = ThreadPoolExecutor(max_workers=1)
+        dataset.prefetch = (self._prefetcher.submit(self._prefetch_query, sql, pars), size, self._writeseq)
+
+    def _prefetch_query(self, sql, pars):
+        """
+        Runs on the prefetch thread, which owns the second connection
+        """
+        if self._prefetch_db is None:
+            import core.database.factory
+            self._prefetch_db = core.database.factory.ServerFactory.CreateServer(core.application.Application.instance)
+            self._prefetch_db.connect()
+
+        try:
+            return self._prefetch_db.query_dataset(sql, pars)
+        finally:
+            self._prefetch_db.commit()
+
+    def _prefetch_result(self, dataset: Dataset, size):
+        """
+        Returns the dataset read ahead, None if not usable (changes executed meanwhile, different size or error)
+        """
+        future, prefetch_size, writeseq = dataset.prefetch
+        dataset.prefetch = None
 
-    def table_get(self, table: core.object.table.Table, pk):
+        try:
+            res = future.result()
+        except Exception:
+            core.application.Application.logexception('prefetch')
+            return None
+
+        if (writeseq != self._writeseq) or (prefetch_size != size):
+            return None
+
+        return res
+
+    def _prefetch_close(self):
+        """
+        Disconnect the prefetch connection and stop its thread
+        """
+        if self._prefetcher is None:
+            return
+
+        def close():
+            if self._prefetch_db is not None:
+                self._prefetch_db.disconnect()
+                self._prefetch_db = None
+
+        self._prefetcher.submit(close)
+        self._prefetcher.shutdown()
+        self._prefetcher = None
+
+    def _stream_next(self, dataset: Dataset, size=None) -> Dataset:
+        """
+        Fetch the next rows of a streamed dataset
+        """
+        res = Dataset(dataset.columns)
+        res.plan = dataset.plan
+        res.skipped = dataset.skipped
+
+        rows = dataset.cursor.fetchmany(self.dataset_size if size is None else size)
+        if rows:
+            res.extend(rows)
+            res.cursor = dataset.cursor
+            self._stream = res
+        else:
+            self._stream_suspend()
+
+        return res
+
+    def _execute_begin(self, sql):
+        """
+        Called before each statement: closes the open stream and tracks changes of the transaction
+        """
+        self._stream_suspend()
+        if not sql.startswith('SELECT'):
+            self._writeseq += 1
+
+        # statements on a table (reads included) see the buffered changes
+        if self._buffer and (not self._flushing):
+            for sqlname in list(self._buffer):
+                if self.dialect.quote(sqlname) in sql:
+                    self._flush(sqlname)
+
+    def _transaction_end(self, commit):
+        """
+        Called on commit and rollback, before the connection ends the transaction
+        The record cache is promoted by commit only once the connection has committed
+        """
+        self._buffer.clear()
+        self._stream_suspend()
+        self._writeseq_tx = self._writeseq
+        if not commit:
+            self.cache.clear()
+
+    def _stream_suspend(self):
+        """
+        Close the open stream before using the connection for another statement
+        Its table goes on with keyset pagination from the last row read
+        """
+        if self._stream is not None:
+            self._stream.cursor.close()
+            self._stream.cursor = None
+            self._stream = None
+
+    def table_findfirst(self, table: core.object.table.Table):
+        """
+        Select the first record from the database
+        """
+        return self._table_findset(table=table, size=1)
+
+    def table_findlast(self, table: core.object.table.Table):
+        """
+        Select the last record from the database
+        """
+        return self._table_findset(table=table, size=1, ascending=not (table._ascending ^ False))
+
+    def table_get(self, table: core.object.table.Table, pk) -> Dataset:
         """
         Get record by primary key
         """
+        if table._cached and (not table._locktable) and (not self.tablecache.ischanged(table._sqlname)):
+            res = self._cached_get(table, pk)
+            if res is not None:
+                return res
+
+        if (not table._pkcache) or table._locktable or table._loadfields:
+            return self._table_findset(table=table, pk=pk)
+
+        key = self.cache.getkey(pk)
+        dataset = self.cache.get(table.__class__, key)
+        if (dataset is not None) and table._pkcache_validate:
+            if self._read_rowversion(table, pk) != dataset[0][dataset.columns['timestamp']]:
+                dataset = None
+
+        if dataset is None:
+            dataset = self._table_findset(table=table, pk=pk)
+            if not dataset:
+                self.cache.invalidate(table.__class__, key)
+                return dataset
+
+            self.cache.put(table.__class__, key, dataset, table._pkcache_validate)
+
+        # the plan of a dataset refers to the fields of a table instance
+        res = Dataset(dataset.columns)
+        res.extend(dataset)
+        return res
+
+    def _read_rowversion(self, table: core.object.table.Table, pk):
+        """
+        Returns the rowversion of the record with primary key, None if missing
+        """
+        key = (table.__class__, 'rowversion')
+        stmt = self._statements.get(key)
+        if stmt is None:
+            node = core.database.dialect.Select(table._sqlname, [core.database.dialect.Column('timestamp')],
+                                                [self._get_wherepk(table, False)])
+            stmt = Statement(self.dialect.render(node))
+            self._statements[key] = stmt
+
+        pars = []
+        i = 0
+        for field in table._primarykey:
+            pars.append(self._tosql[field.type](pk[i]))
+            i += 1
+
+        rows = self.query_dataset(stmt.sql, pars)
+        if rows:
+            return rows[0][0]
+        else:
+            return None
+
+    def _cached_get(self, table: core.object.table.Table, pk) -> Dataset:
+        """
+        Get record by primary key from the snapshot of a table declared with _cached, None if not found
+        """
+        snap = self.tablecache.get(table._sqlname)
+        if (snap is not None) and self.tablecache.tocheck(snap):
+            if self._read_tablemark(table) != snap['mark']:
+                snap = None
+            else:
+                snap['checked'] = time.monotonic()
+
+        if snap is None:
+            snap = self._load_snapshot(table)
+
+        dataset = snap['dataset']
+        i = snap['index'].get(self.cache.getkey(pk))
+        if i is None:
+            return None
+
+        res = Dataset(dataset.columns)
+        res.append(dataset[i])
+        return res
+
+    def _load_snapshot(self, table: core.object.table.Table):
+        """
+        Read all the rows of the table, indexed by primary key
+        """
+        version = self.tablecache.version(table._sqlname)
+        mark = self._read_tablemark(table)
+
+        columns = [core.database.dialect.Column(field.sqlname) for field in table._fields]
+        columns.append(core.database.dialect.Column('timestamp'))
+        node = core.database.dialect.Select(table._sqlname, columns)
+        dataset = self.query_dataset(self.dialect.render(node))
+
+        fromsql = self._get_fromsql()
+        pkcols = [(dataset.columns[field.sqlname], fromsql[field.type]) for field in table._primarykey]
+        index = {}
+        for i, row in enumerate(dataset):
+            index[self.cache.getkey([conv(row[c]) for c, conv in pkcols])] = i
+
+        return self.tablecache.put(table._sqlname, version, mark, dataset, index)
+
+    def _read_tablemark(self, table: core.object.table.Table):
+        """
+        Returns rows count and max rowversion of the table
+        """
+        node = core.database.dialect.Select(table._sqlname, [core.database.dialect.Raw('COUNT(*)', 'c'),
+                                                             core.database.dialect.Aggregate('MAX', core.database.dialect.Column('timestamp'), 't')])
+        row = self.query_dataset(self.dialect.render(node))[0]
+        return row[0], row[1]
+
+    def cache_invalidate(self, table: core.object.table.Table, pk=None):
+        """
+        Remove the record (or all records, without pk) of the table from the primary key cache
+        Changes of tables declared with _cached are notified to all processes at commit
+        """
+        if table._pkcache:
+            self.cache.invalidate(table.__class__, None if pk is None else self.cache.getkey(pk))
+
+        if table._cached:
+            self.tablecache.change(table._sqlname)
 
     def from_sqlvalue(self, field: core.field.field.Field, value):
         """
         Convert sql value to core value
         """
+        fromsql = self._get_fromsql()
+        if field.type not in fromsql:
+            raise Exception(label('Unknown field type \'{0}\''.format(field.type)))
+
+        return fromsql[field.type](value)
 
     def to_sqlvalue(self, field: core.field.field.Field, value):
         """
         Convert core value to sql value
         """
+        if field.type not in self._tosql:
+            raise Exception(label('Unknown field type \'{0}\''.format(field.type)))
+
+        return self._tosql[field.type](value)
+
+    def table_loadrow(self, table: core.object.table.Table, dataset: Dataset, index):
+        """
+        Load a dataset row into table, setting both value and xvalue of the fields
+        """
+        row = dataset[index]
+        for field, i, conv in dataset.getplan(table, self._get_fromsql()):
+            field._load(conv(row[i]))
+
+        for field in dataset.skipped:
+            field._load(field.initvalue)
+        table._partial = len(dataset.skipped) > 0
+
+        table._rowversion = row[dataset.columns['timestamp']]
+
+    def _get_changed(self, table: core.object.table.Table):
+        """
+        Returns the positions of the fields changed since the record was loaded, primary key excluded
+        """
+        changed = []
+        for i, field in enumerate(table._fields):
+            if field in table._primarykey:
+                continue
+            if field.value == field.xvalue:
+                continue
+            changed.append(i)
+
+        return changed
+
+    def _get_changedfields(self, table: core.object.table.Table, entry):
+        """
+        Returns the fields whose column type differs from the catalog
+        """
+        res = []
+        if entry is None:
+            return res
+
+        for field in table._fields:
+            for row in entry['columns']:
+                if row['name'] == field.sqlname:
+                    if self._get_fieldtype(field) != self._get_curdef(row):
+                        res.append(field)
+                    break
+
+        return res
+
+    def _list_fields(self, fields: List[core.field.field.Field], prefix=''):
+        """
+        Returns the comma separated list of quoted field names
+        """
+        res = ''
+        comma = False
+        for field in fields:
+            if comma:
+                res += ', '
+            comma = True
+            res += prefix + self.dialect.quote(field.sqlname)
+        return res
+
+    def _get_indexdef(self, unique, fields: list, include: list):
+        """
+        Returns a comparable definition of an index
+        """
+        res = 'UNIQUE ' if unique else ''
+        res += '(' + ', '.join(fields) + ')'
+        if include:
+            res += ' INCLUDE (' + ', '.join(include) + ')'
+        return res
+
+    def _get_identity(self, table: core.object.table.Table):
+        """
+        Returns the position of the autoincrement field, None if missing
+        """
+        key = (table.__class__, 'identity')
+        stmt = self._statements.get(key)
+        if stmt is None:
+            stmt = Statement('')
+            for i, field in enumerate(table._fields):
+                if field.type in [FieldType.INTEGER, FieldType.BIGINTEGER]:
+                    if field.autoincrement:
+                        stmt.fields.append(i)
+            self._statements[key] = stmt
+
+        if stmt.fields:
+            return stmt.fields[0]
+        else:
+            return None
+
+    def _get_wherepk(self, table: core.object.table.Table, with_timestamp=True):
+        """
+        Returns the predicate on primary key (and rowversion)
+        """
+        where = core.database.dialect.And()
+        for field in table._primarykey:
+            where.items.append(core.database.dialect.Compare(field.sqlname))
+
+        if with_timestamp:
+            where.items.append(core.database.dialect.Compare('timestamp'))
+
+        return where
+
+    def _bind_wherepk(self, table: core.object.table.Table, pars, with_timestamp=True):
+        """
+        Bind the parameters of _get_wherepk
+        """
+        for field in table._primarykey:
+            pars.append(self._tosql[field.type](field.value))
+
+        if with_timestamp:
+            pars.append(table._rowversion)
+
+    def _get_filters(self, table: core.object.table.Table, fields: List[core.field.field.Field] = None):
+        """
+        Returns the filters of the table (or of some fields only) grouped by level
+        """
+        fltrs = {}
+        for field in (table._fields if fields is None else fields):
+            for flt in field.filters:
+                if flt.level not in fltrs:
+                    fltrs[flt.level] = []
+                fltrs[flt.level].append(flt)
+
+        return fltrs
+
+    def _get_filtershape(self, table: core.object.table.Table, fltrs):
+        """
+        Returns a hashable description of the filters (without values) used as cache key
+        """
+        shape = []
+        for l in fltrs:
+            shape.append((l, table._filterlevelmode.get(l, 'AND')))
+            for flt in fltrs[l]:
+                shape.append((flt.field.sqlname, flt.type, flt.shape()))
+
+        return tuple(shape)
+
+    def _get_where(self, table: core.object.table.Table, fltrs, left: Callable = None):
+        """
+        Returns the predicates of the current filters, one for each level
+        left returns the node compared in place of the column of each field (qualified column, function)
+        """
+        # split by levels to allow OR instead of AND join
+        where = []
+        for l in fltrs:
+            if table._filterlevelmode.get(l, 'AND') == 'OR':
+                levwh = core.database.dialect.Or()
+            else:
+                levwh = core.database.dialect.And()
+
+            for flt in fltrs[l]:
+                node = left(flt.field) if left is not None else None
+                if flt.type == 'equal':
+                    levwh.items.append(core.database.dialect.Compare(flt.field.sqlname, left=node))
+
+                elif flt.type == 'range':
+                    levwh.items.append(core.database.dialect.Between(flt.field.sqlname, left=node))
+
+                elif flt.type == 'expr':
+                    levwh.items.append(core.database.dialect.Expression(flt, left=node))
+
+            where.append(levwh)
+
+        return where
+
+    def _bind_where(self, fltrs, pars):
+        """
+        Bind the parameters of _get_where
+        """
+        for l in fltrs:
+            for flt in fltrs[l]:
+                conv = self._tosql[flt.field.type]
+                if flt.type == 'equal':
+                    pars.append(conv(flt.value))
+
+                elif flt.type == 'range':
+                    pars.append(conv(flt.min_value))
+                    pars.append(conv(flt.max_value))
+
+                elif flt.type == 'expr':
+                    for v in flt.parameters():
+                        pars.append(conv(v))
+
+    def _table_findset(self, *, table: core.object.table.Table, size=None, offset=None, nextset=False, ascending=None, pk=None,
+                       stream=False):
+        """
+        Select a dataset through the cached statement built by _build_findset
+        """
+        sql, pars = self._prepare_findset(table=table, size=size, offset=offset, nextset=nextset, ascending=ascending,
+                                          pk=pk, stream=stream)
+        return self.query_dataset(sql, pars, stream, size)
+
+    def _prepare_findset(self, *, table: core.object.table.Table, size=None, offset=None, nextset=False, ascending=None,
+                         pk=None, stream=False, lastrow: Dataset = None):
+        """
+        Returns statement and parameters of a findset
+        With lastrow the keyset is bound to the (sql) values of the last row of the dataset instead of table fields
+        """
+        if ascending is None:
+            ascending = table._ascending
+
+        fltrs = None
+        if pk:
+            key = (table.__class__, 'get', table._locktable, tuple(field.sqlname for field in table._loadfields))
+        else:
+            fltrs = self._get_filters(table)
+            key = (table.__class__, 'nextset' if nextset else 'stream' if stream else 'findset', table._locktable, ascending,
+                   tuple(field.sqlname for field in table._currentkey), self._get_filtershape(table, fltrs),
+                   tuple(field.sqlname for field in table._loadfields))
+
+        stmt = self._statements.get(key)
+        if stmt is None:
+            stmt = self._build_findset(table, nextset, ascending, pk, fltrs, stream)
+            self._statements[key] = stmt
+
+        pars = []
+        if pk:
+            i = 0
+            for field in table._primarykey:
+                pars.append(self._tosql[field.type](pk[i]))
+                i += 1
+
+        else:
+            for i in stmt.fields:
+                field = table._fields[i]
+                if lastrow is not None:
+                    pars.append(lastrow[-1][lastrow.columns[field.sqlname]])
+                else:
+                    pars.append(self._tosql[field.type](field.value))
+
+            self._bind_where(fltrs, pars)
+
+            if not stream:
+                pars.append(0 if offset is None else offset)
+                pars.append(self.dataset_size if size is None else size)
+
+        return stmt.sql, pars
+
+    def _get_filtered(self, table: core.object.table.Table, op, node):
+        """
+        Returns the cached statement and the parameters of a statement (node) filtered by current filters
+        """
+        fltrs = self._get_filters(table)
+        key = (table.__class__, op, self._get_filtershape(table, fltrs))
+        stmt = self._statements.get(key)
+        if stmt is None:
+            node.where += self._get_where(table, fltrs)
+            stmt = Statement(self.dialect.render(node))
+            self._statements[key] = stmt
+
+        pars = []
+        self._bind_where(fltrs, pars)
+        return stmt, pars
+
+    def _build_findset(self, table: core.object.table.Table, nextset, ascending, pk, fltrs, stream=False) -> Statement:
+        """
+        Build the SELECT statement for the dataset, parameters: keyset fields, filters, offset and size
+        In stream mode the whole result set is selected, without offset and size
+        """
+        stmt = Statement('')
+
+        columns = [core.database.dialect.Column(field.sqlname) for field in table._getloadfields()]
+        columns.append(core.database.dialect.Column('timestamp'))
+        node = core.database.dialect.Select(table._sqlname, columns, lock='update' if table._locktable else 'nolock')
+
+        if pk:
+            node.where.append(self._get_wherepk(table, False))
+
+        else:
+            if nextset:
+                keyset = core.database.dialect.Keyset([field.sqlname for field in table._currentkey], not ascending)
+                for name in self.dialect.keyset_names(keyset):
+                    for i, field in enumerate(table._fields):
+                        if field.sqlname == name:
+                            stmt.fields.append(i)
+                node.where.append(keyset)
+
+            node.where += self._get_where(table, fltrs)
+
+            node.orderby = [(field.sqlname, not ascending) for field in table._currentkey]
+            if not stream:
+                node.limit = True
+
+        stmt.sql = self.dialect.render(node)
+        return stmt
+
+    def query_findset(self, query: core.object.query.Query, size=None, offset=None, stream=False) -> Dataset:
+        """
+        Select dataset of a query from the database
+        In stream mode a single query is executed, the following rows are fetched by query_nextset
+        """
+        sql, pars = self._prepare_query(query, size, offset, stream)
+        return self.query_dataset(sql, pars, stream, size)
+
+    def query_nextset(self, query: core.object.query.Query, size=None) -> Dataset:
+        """
+        Select next dataset of a query (pagination by offset of the rows already read)
+        """
+        dataset = query._dataset
+        if (dataset is not None) and (dataset.cursor is not None):
+            return self._stream_next(dataset, size)
+
+        return self.query_findset(query, size=size, offset=query._offset)
+
+    def query_loadrow(self, query: core.object.query.Query, dataset: Dataset, index):
+        """
+        Load a dataset row into the columns of the query, NULL of unmatched outer joins as initial value
+        """
+        row = dataset[index]
+        for field, i, conv in dataset.getplan(query, self._get_fromsql()):
+            value = row[i]
+            field._load(field.initvalue if value is None else conv(value))
+
+    def _prepare_query(self, query: core.object.query.Query, size=None, offset=None, stream=False):
+        """
+        Returns statement and parameters of a query, parameters: join conditions, filters of the data items,
+        filters of the columns (grouped columns first, then aggregated), offset and size
+        """
+        items = [self._get_filters(item.table) for item in query._dataitems]
+        grouped = self._get_filters(query, [col.field for col in query._columns if not col.method])
+        aggregated = self._get_filters(query, [col.field for col in query._columns if col.method])
+
+        key = (query.__class__, 'stream' if stream else 'query', query._ascending,
+               tuple(field._codename for field in query._currentkey),
+               tuple(self._get_filtershape(item.table, fltrs) for item, fltrs in zip(query._dataitems, items)),
+               self._get_filtershape(query, grouped), self._get_filtershape(query, aggregated))
+
+        stmt = self._statements.get(key)
+        if stmt is None:
+            stmt = self._build_query(query, items, grouped, aggregated, stream)
+            self._statements[key] = stmt
+
+        pars = []
+        for item in query._dataitems:
+            for field, other in item.on:
+                if not isinstance(other, core.field.field.Field):
+                    pars.append(self._tosql[field.type](other))
+
+        for fltrs in items:
+            self._bind_where(fltrs, pars)
+        self._bind_where(grouped, pars)
+        self._bind_where(aggregated, pars)
+
+        if not stream:
+            pars.append(0 if offset is None else offset)
+            pars.append(self.dataset_size if size is None else size)
+
+        return stmt.sql, pars
+
+    def _build_query(self, query: core.object.query.Query, items, grouped, aggregated, stream=False) -> Statement:
+        """
+        Build the SELECT statement of a query: data items joined in order, grouped by the columns without method
+        """
+        aliases = {}
+        for item in query._dataitems:
+            aliases[id(item.table)] = item.alias
+
+        def column(field):
+            return core.database.dialect.Column(field.sqlname, self.dialect.quote(aliases[id(field._parent)]) + '.')
+
+        sources = {}
+        columns = []
+        groupby = []
+        for col in query._columns:
+            # COUNT counts the rows of the data item matched by the join
+            if col.method:
+                sources[id(col.field)] = core.database.dialect.Aggregate(col.method, column(col.source))
+                columns.append(core.database.dialect.Aggregate(col.method, column(col.source), col.field.sqlname))
+            else:
+                sources[id(col.field)] = column(col.source)
+                groupby.append(column(col.source))
+                columns.append(core.database.dialect.Column(col.source.sqlname, sources[id(col.field)].prefix,
+                                                            col.field.sqlname))
+
+        first = query._dataitems[0]
+        node = core.database.dialect.Select(first.table._sqlname, columns, lock='nolock', alias=first.alias)
+
+        for item in query._dataitems[1:]:
+            on = []
+            for field, other in item.on:
+                if isinstance(other, core.field.field.Field):
+                    on.append(core.database.dialect.Equal(column(field), column(other)))
+                else:
+                    on.append(core.database.dialect.Compare(field.sqlname, left=column(field)))
+            node.joins.append(core.database.dialect.Join(item.table._sqlname, item.alias, on, item.outer))
+
+        for item, fltrs in zip(query._dataitems, items):
+            node.where += self._get_where(item.table, fltrs, column)
+        node.where += self._get_where(query, grouped, lambda field: sources[id(field)])
+
+        if len(groupby) < len(query._columns):
+            node.groupby = groupby
+            node.having = self._get_where(query, aggregated, lambda field: sources[id(field)])
+
+            # the grouped columns identify the rows
+            order = list(query._currentkey)
+            order += [col.field for col in query._columns if (not col.method) and (col.field not in order)]
+            node.orderby = [(field.sqlname, not query._ascending) for field in order]
+
+        else:
+            # columns of the current key, then primary keys of the data items identify the rows
+            node.orderby = [(sources[id(field)], not query._ascending) for field in query._currentkey]
+            for item in query._dataitems:
+                node.orderby += [(column(field), not query._ascending) for field in item.table._primarykey]
+
+        if not stream:
+            node.limit = True
+
+        return Statement(self.dialect.render(node))
+
+    def _get_fieldtype(self, field: core.field.field.Field):
+        """
+        Returns the column definition of the field
+        """
+
+    def _get_curdef(self, row):
+        """
+        Returns the definition of a column in the catalog, comparable with _get_fieldtype
+        """
 
-    def table_loadrow(self, table: core.object.table.Table, row: dict):
+    def _get_fromsql(self) -> dict:
         """
-        Load a datasetrow into table
+        Returns the converters from sql value by field type, resolved once per session timezone
         """
 
     def _statement_begin(self, sql, parameters):
@@ -0,0 +1,558 @@
+import os
+import sqlite3
+from decimal import Decimal
+from datetime import datetime, date, time, timezone
+import core.database.server
+import core.database.dialect
+import core.object.table
+import core.session
+import core.application
+from core.language import label
+from core.utility.convert import Convert
+from core.field.field import Field, FieldType
+
+
+def _same(value):
+    return value
+
+
+class Sqlite(core.database.server.Server):
+    """
+    Embedded database on a single file in the instance folder, no server required
+    Rowversion is emulated by the [$dbts] counter table, autoincrement by MAX + 1 under the write lock
+    """
+    def __init__(self):
+        super().__init__()
+        self._conn: sqlite3.Connection = None
+        self._tosql = self._get_tosql()
+        # SQLite allows 32766 parameters per statement and an expression depth of 1000
+        self._max_parameters = 32000
+        self._max_rows = 500
+        self.dialect = core.database.dialect.SqliteDialect()
+
+    def connect(self):
+        if self.db_name == ':memory:':
+            fn = self.db_name
+            # another connection would open another database
+            self._can_prefetch = False
+        else:
+            fn = core.application.Application.instance['path'] + self.db_name + '.db'
+
+        # transactions are handled explicitly, see _execute
+        self._conn = sqlite3.connect(fn, timeout=30, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS [$dbts] ([value] BIGINT NOT NULL)')
+        self._conn.execute('INSERT INTO [$dbts] ([value]) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM [$dbts])')
+
+    def disconnect(self):
+        self._stream_suspend()
+        self._prefetch_close()
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def commit(self):
+        self._flush_commit()
+        self._transaction_end(True)
+        if self._conn.in_transaction:
+            self._conn.execute('COMMIT')
+        self.cache.commit()
+        self.tablecache.commit()
+
+    def rollback(self):
+        self._transaction_end(False)
+        if self._conn.in_transaction:
+            self._conn.execute('ROLLBACK')
+        self.tablecache.rollback()
+
+    def get_connectionid(self):
+        return os.getpid()
+
+    def _execute(self, sql, parameters: list = None):
+        self._execute_begin(sql)
+
+        # like SQL Server, every statement (DDL included) runs in a transaction closed by commit or rollback
+        if not self._conn.in_transaction:
+            self._conn.execute('BEGIN')
+
+        self._statement_begin(sql, parameters)
+
+        try:
+            if not parameters:
+                cur = self._conn.execute(sql)
+            else:
+                cur = self._conn.execute(sql, parameters)
+        finally:
+            self._statement_end()
+
+        return cur
+
+    def execute(self, sql, parameters: list = None):
+        cur = self._execute(sql, parameters)
+        return cur.rowcount
+
+    def query(self, sql, parameters: list = None):
+        cur = self._execute(sql, parameters)
+
+        res = []
+        while True:
+            row = cur.fetchone()
+            if not row:
+                break
+
+            line = {}
+            i = 0
+            for col in cur.description:
+                colname = col[0]
+                line[colname] = row[i]
+                i += 1
+            res.append(line)
+
+        return res
+
+    def query_dataset(self, sql, parameters: list = None, stream=False, size=None):
+        cur = self._execute(sql, parameters)
+
+        columns = {}
+        i = 0
+        for col in cur.description:
+            columns[col[0]] = i
+            i += 1
+
+        res = core.database.server.Dataset(columns)
+        if stream:
+            res.extend(cur.fetchmany(self.dataset_size if size is None else size))
+            res.cursor = cur
+            self._stream = res
+            return res
+
+        while True:
+            rows = cur.fetchmany(self.dataset_size)
+            if not rows:
+                break
+            res.extend(rows)
+
+        return res
+
+    def _get_rowversion(self, count=1):
+        """
+        Reserve count rowversions, returns the last one
+        The update takes the write lock of the database until commit
+        """
+        sql = 'UPDATE [$dbts] SET [value] = [value] + ? RETURNING [value]'
+        return self.query_dataset(sql, [count])[0][0]
+
+    def _get_nextidentity(self, table: core.object.table.Table, identity_index):
+        """
+        Returns the next value of the autoincrement field, to be called after _get_rowversion
+        """
+        field = table._fields[identity_index]
+        sql = 'SELECT COALESCE(MAX([' + field.sqlname + ']), 0) + 1 FROM [' + table._sqlname + ']'
+        return self.query_dataset(sql)[0][0]
+
+    def _get_fieldtype(self, field: Field):
+        res = ''
+        if field.type in [FieldType.CODE, FieldType.TEXT]:
+            res += 'NVARCHAR(' + str(field.length) + ') NOT NULL DEFAULT \'\' COLLATE NOCASE'
+
+        elif field.type in [FieldType.INTEGER, FieldType.OPTION]:
+            res += 'INTEGER NOT NULL DEFAULT 0'
+
+        elif field.type in [FieldType.BIGINTEGER]:
+            res += 'BIGINT NOT NULL DEFAULT 0'
+
+        elif field.type in [FieldType.DECIMAL]:
+            res += 'DECIMAL(' + str(field.precision) + ',' + str(field.scale) + ') NOT NULL DEFAULT 0'
+
+        elif field.type in [FieldType.DATE]:
+            res += 'VARCHAR(10) NOT NULL DEFAULT \'\''
+
+        elif field.type in [FieldType.DATETIME]:
+            res += 'VARCHAR(23) NOT NULL DEFAULT \'\''
+
+        elif field.type in [FieldType.TIME]:
+            res += 'VARCHAR(12) NOT NULL DEFAULT \'\''
+
+        elif field.type in [FieldType.BOOLEAN]:
+            res += 'BOOLEAN NOT NULL DEFAULT 0'
+
+        else:
+            raise Exception(label('Unknown field type \'{0}\''.format(field.type[1])))
+
+        return res
+
+    def _get_curdef(self, row):
+        """
+        Returns the definition of a column in the catalog, comparable with _get_fieldtype
+        """
+        curdef = row['type']
+        if row['notnull'] == 1:
+            curdef += ' NOT NULL'
+        if row['dflt_value'] is not None:
+            curdef += ' DEFAULT ' + row['dflt_value']
+        if row['type'].startswith('NVARCHAR'):
+            curdef += ' COLLATE NOCASE'
+        return curdef
+
+    def _get_indexdef(self, unique, fields: list, include: list):
+        # no included columns, they are appended to the key (unless unique, that would change the constraint)
+        if not unique:
+            fields = fields + include
+        return super()._get_indexdef(unique, fields, [])
+
+    def schema_snapshot(self, tablename=None):
+        catalog = {}
+
+        sql = 'SELECT [name] FROM sqlite_master WHERE ([type] = ?) AND ([name] NOT LIKE ? ESCAPE ?) AND ([name] <> ?)'
+        pars = ['table', 'sqlite!_%', '!', '$dbts']
+        if tablename is not None:
+            sql += ' AND ([name] = ?)'
+            pars.append(tablename)
+
+        for tab in self.query(sql, pars):
+            tab = tab['name']
+            entry = {'columns': [], 'primarykey': [], 'indexes': {}}
+            catalog[tab] = entry
+
+            sql = 'SELECT [name], [type], [notnull], [dflt_value], [pk] FROM pragma_table_info(?) ORDER BY [cid]'
+            for row in self.query(sql, [tab]):
+                entry['columns'].append(row)
+
+            for row in sorted(entry['columns'], key=lambda r: r['pk']):
+                if row['pk'] > 0:
+                    entry['primarykey'].append(row['name'])
+
+            # only secondary indexes managed by Core
+            sql = 'SELECT [name], [unique] FROM pragma_index_list(?) WHERE [origin] = ?'
+            for idx in self.query(sql, [tab, 'c']):
+                if not idx['name'].startswith(tab + '$'):
+                    continue
+
+                sql = 'SELECT [name] FROM pragma_index_info(?) ORDER BY [seqno]'
+                fields = [row['name'] for row in self.query(sql, [idx['name']])]
+                entry['indexes'][idx['name']] = self._get_indexdef(idx['unique'] == 1, fields, [])
+
+        return catalog
+
+    def _create_table(self, table: core.object.table.Table, sqlname, plan: list):
+        sql = 'CREATE TABLE [' + sqlname + '] ('
+        for field in table._fields:
+            sql += '[' + field.sqlname + '] ' + self._get_fieldtype(field) + ', '
+        sql += '[timestamp] BIGINT NOT NULL DEFAULT 0, '
+        sql += 'CONSTRAINT [' + table._sqlname + '$PK] PRIMARY KEY (' + self._list_fields(table._primarykey) + ')'
+        sql += ')'
+        plan.append((sql, False))
+
+    def _process_table(self, table: core.object.table.Table, entry, plan: list, changed: list):
+        """
+        Add the new columns, or rebuild the table when columns or primary key are changed or dropped
+        Returns True if the table has been (re)created
+        """
+        if entry is None:
+            self._create_table(table, table._sqlname, plan)
+            return True
+
+        toadd = []
+        keep = []
+        for field in table._fields:
+            if field in changed:
+                continue
+
+            ok = False
+            for row in entry['columns']:
+                if row['name'] == field.sqlname:
+                    ok = True
+                    break
+
+            if ok:
+                keep.append(field)
+            else:
+                toadd.append(field)
+
+        # columns not kept, changed or added (timestamp apart) are dropped
+        newpk = [fld.sqlname for fld in table._primarykey]
+        rebuild = (len(keep) + len(changed) + 1 != len(entry['columns'])) or (len(changed) > 0) or \
+            (newpk != entry['primarykey'])
+
+        if not rebuild:
+            for field in toadd:
+                sql = 'ALTER TABLE [' + table._sqlname + '] '
+                sql += 'ADD COLUMN [' + field.sqlname + '] ' + self._get_fieldtype(field)
+                plan.append((sql, False))
+            return False
+
+        # SQLite cannot alter or drop columns in keys, the table is copied with the new definition
+        # changed columns are converted by the column affinity
+        tmpname = table._sqlname + '$new'
+        self._create_table(table, tmpname, plan)
+
+        fields = keep + changed
+        sql = 'INSERT INTO [' + tmpname + '] (' + self._list_fields(fields) + ', [timestamp]) '
+        sql += 'SELECT ' + self._list_fields(fields) + ', [timestamp] FROM [' + table._sqlname + ']'
+        plan.append((sql, True))
+
+        plan.append(('DROP TABLE [' + table._sqlname + ']', True))
+        plan.append(('ALTER TABLE [' + tmpname + '] RENAME TO [' + table._sqlname + ']', False))
+        return True
+
+    def _process_indexes(self, table: core.object.table.Table, curidx: dict, plan: list, drop: bool, changed: list):
+        """
+        Drop (before columns are changed) or create (after) the secondary indexes of the table
+        """
+        newidx = {}
+        for name in table._indexes:
+            newidx[table._sqlname + '$' + Convert.to_sqlname(name)] = table._indexes[name]
+
+        keep = []
+        for name in newidx:
+            idx = newidx[name]
+            if name not in curidx:
+                continue
+            if curidx[name] != self._get_indexdef(idx['unique'], [f.sqlname for f in idx['fields']],
+                                                  [f.sqlname for f in idx['include']]):
+                continue
+
+            ok = True
+            for fld in idx['fields'] + idx['include']:
+                if fld in changed:
+                    ok = False
+            if ok:
+                keep.append(name)
+
+        if drop:
+            for name in curidx:
+                if name not in keep:
+                    plan.append(('DROP INDEX [' + name + ']', False))
+
+        else:
+            for name in newidx:
+                if name in keep:
+                    continue
+
+                idx = newidx[name]
+                fields = idx['fields']
+                if not idx['unique']:
+                    fields = fields + idx['include']
+
+                sql = 'CREATE '
+                if idx['unique']:
+                    sql += 'UNIQUE '
+                sql += 'INDEX [' + name + '] ON [' + table._sqlname + '] ('
+                sql += self._list_fields(fields)
+                sql += ')'
+                plan.append((sql, False))
+
+    def table_compile(self, table: core.object.table.Table, catalog: dict = None, check=False):
+        if not table._primarykey:
+            table._error_noprimarykey()
+
+        if catalog is None:
+            catalog = self.schema_snapshot(table._sqlname)
+        entry = catalog.get(table._sqlname)
+
+        plan = []
+        changed = self._get_changedfields(table, entry)
+        curidx = entry['indexes'] if entry is not None else {}
+        self._process_indexes(table, curidx, plan, True, changed)
+        if self._process_table(table, entry, plan, changed):
+            curidx = {}
+        self._process_indexes(table, curidx, plan, False, changed)
+
+        if not check:
+            for sql, disruptive in plan:
+                self.execute(sql)
+
+        return plan
+
+    def _get_fromsql(self):
+        tz = core.session.Session.timezone
+        if (self._fromsql is not None) and (self._fromsql_tz is tz):
+            return self._fromsql
+
+        utc = timezone.utc
+
+        def from_decimal(value):
+            # decimals are stored as REAL: 15 significant digits are exact, the following ones are binary noise
+            # (sum of ten 0.1 is 0.9999999999999999)
+            if isinstance(value, float):
+                value = '%.15g' % value
+            return Decimal(str(value)).normalize()
+
+        def from_boolean(value):
+            return bool(value)
+
+        def from_datetime(value):
+            if value == '':
+                return None
+            return datetime.fromisoformat(value).replace(tzinfo=utc).astimezone(tz)
+
+        def from_date(value):
+            if value == '':
+                return None
+            return date.fromisoformat(value)
+
+        def from_time(value):
+            if value == '':
+                return None
+            return time.fromisoformat(value)
+
+        self._fromsql = {
+            FieldType.CODE: _same,
+            FieldType.TEXT: _same,
+            FieldType.INTEGER: _same,
+            FieldType.BIGINTEGER: _same,
+            FieldType.OPTION: _same,
+            FieldType.DECIMAL: from_decimal,
+            FieldType.BOOLEAN: from_boolean,
+            FieldType.DATETIME: from_datetime,
+            FieldType.DATE: from_date,
+            FieldType.TIME: from_time
+        }
+        self._fromsql_tz = tz
+        return self._fromsql
+
+    @staticmethod
+    def _get_tosql():
+        """
+        Returns the converters to sql value by field type
+        Dates and times are stored as ISO text (empty for None), datetime in UTC
+        """
+        utc = timezone.utc
+
+        def to_decimal(value):
+            return str(value)
+
+        def to_boolean(value):
+            return 1 if value else 0
+
+        def to_datetime(value):
+            if value is None:
+                return ''
+            return value.astimezone(utc).replace(tzinfo=None).isoformat(' ', 'milliseconds')
+
+        def to_date(value):
+            if value is None:
+                return ''
+            return value.isoformat()
+
+        def to_time(value):
+            if value is None:
+                return ''
+            return value.isoformat('milliseconds')
+
+        return {
+            FieldType.CODE: _same,
+            FieldType.TEXT: _same,
+            FieldType.INTEGER: _same,
+            FieldType.BIGINTEGER: _same,
+            FieldType.DECIMAL: to_decimal,
+            FieldType.OPTION: _same,
+            FieldType.BOOLEAN: to_boolean,
+            FieldType.DATETIME: to_datetime,
+            FieldType.DATE: to_date,
+            FieldType.TIME: to_time
+        }
+
+    def table_insert(self, table: core.object.table.Table):
+        rowversion = self._get_rowversion()
+
+        identity_index = self._get_identity(table)
+        if (identity_index is not None) and (table._fields[identity_index].value == 0):
+            table._fields[identity_index].value = self._get_nextidentity(table, identity_index)
+
+        key = (table.__class__, 'insert')
+        stmt = self._statements.get(key)
+        if stmt is None:
+            node = core.database.dialect.Insert(table._sqlname, [field.sqlname for field in table._fields] + ['timestamp'])
+
+            stmt = core.database.server.Statement(self.dialect.render(node), list(range(len(table._fields))))
+            self._statements[key] = stmt
+
+        pars = []
+        for i in stmt.fields:
+            field = table._fields[i]
+            pars.append(self._tosql[field.type](field.value))
+        pars.append(rowversion)
+
+        self.execute(stmt.sql, pars)
+        table._rowversion = rowversion
+
+    def table_insertall(self, table: core.object.table.Table, records: list):
+        if not records:
+            return
+
+        for rec in records:
+            if rec.__class__ is not table.__class__:
+                raise Exception(label('Record \'{0}\' cannot be inserted in \'{1}\''.format(rec._caption, table._caption)))
+
+        rowversion = self._get_rowversion(len(records)) - len(records)
+
+        identity_index = self._get_identity(table)
+        if identity_index is not None:
+            identity = self._get_nextidentity(table, identity_index)
+            for rec in records:
+                field = rec._fields[identity_index]
+                if field.value == 0:
+                    field.value = identity
+                identity = max(identity, field.value) + 1
+
+        batch_size = min(self._max_rows, self._max_parameters // (len(table._fields) + 1))
+        for start in range(0, len(records), batch_size):
+            batch = records[start:start + batch_size]
+
+            key = (table.__class__, 'insertall', len(batch))
+            stmt = self._statements.get(key)
+            if stmt is None:
+                node = core.database.dialect.Insert(table._sqlname, [field.sqlname for field in table._fields] + ['timestamp'],
+                                                    len(batch))
+
+                stmt = core.database.server.Statement(self.dialect.render(node), list(range(len(table._fields))))
+                self._statements[key] = stmt
+
+            pars = []
+            for rec in batch:
+                rowversion += 1
+                for i in stmt.fields:
+                    field = rec._fields[i]
+                    pars.append(self._tosql[field.type](field.value))
+                pars.append(rowversion)
+                rec._rowversion = rowversion
+
+            self.execute(stmt.sql, pars)
+
+    def table_modify(self, table: core.object.table.Table):
+        changed = self._get_changed(table)
+
+        if not changed:
+            return
+
+        key = (table.__class__, 'modify', tuple(changed))
+        stmt = self._statements.get(key)
+        if stmt is None:
+            node = core.database.dialect.Update(table._sqlname, [table._fields[i].sqlname for i in changed] + ['timestamp'],
+                                                [self._get_wherepk(table)])
+
+            stmt = core.database.server.Statement(self.dialect.render(node), changed)
+            self._statements[key] = stmt
+
+        rowversion = self._get_rowversion()
+
+        pars = []
+        for i in stmt.fields:
+            field = table._fields[i]
+            pars.append(self._tosql[field.type](field.value))
+        pars.append(rowversion)
+        self._bind_wherepk(table, pars)
+
+        n = self.execute(stmt.sql, pars)
+        if n != 1:
+            table._error_concurrency()
+        table._rowversion = rowversion
+
+    def table_modifyall(self, table: core.object.table.Table, field: Field, value):
+        node = core.database.dialect.Update(table._sqlname, [field.sqlname, 'timestamp'])
+        stmt, pars = self._get_filtered(table, ('modifyall', field.sqlname), node)
+
+        pars.insert(0, self._tosql[field.type](value))
+        pars.insert(1, self._get_rowversion())
+        self.execute(stmt.sql, pars)
@@ -1,17 +1,22 @@
-from typing import List
 from decimal import Decimal
 from datetime import datetime, date, time
 import dateutil.tz
 import pyodbc
 import core.database.server
+import core.database.dialect
 import core.object.option
 import core.object.table
 import core.session
 import core.application
 from core.language import label
+from core.utility.convert import Convert
 from core.field.field import Field, FieldType
 
 
+def _same(value):
+    return value
+
+
 class SqlServer(core.database.server.Server):
     """
     Defines a generic server class for database
@@ -19,6 +24,8 @@ class SqlServer(core.database.server.Server):
     def __init__(self):
         super().__init__()
         self._conn: pyodbc.Connection = None
+        self._tosql = self._get_tosql()
+        self.dialect = core.database.dialect.SqlServerDialect()
 
     def connect(self):
         dsn = 'DRIVER={ODBC Driver 17 for SQL Server};'
@@ -33,20 +40,30 @@ class SqlServer(core.database.server.Server):
         self._conn = pyodbc.connect(dsn, autocommit=False)
 
     def disconnect(self):
+        self._stream_suspend()
+        self._prefetch_close()
         if self._conn:
             self._conn.close()
             self._conn = None
     
     def commit(self):
+        self._flush_commit()
+        self._transaction_end(True)
         self._conn.commit()
+        self.cache.commit()
+        self.tablecache.commit()
 
     def rollback(self):
+        self._transaction_end(False)
         self._conn.rollback()
+        self.tablecache.rollback()
 
     def get_connectionid(self):
         return self.query('SELECT @@SPID AS [spid]')[0]['spid']
 
     def _execute(self, sql, parameters: list = None):
+        self._execute_begin(sql)
+
         self._statement_begin(sql, parameters)
 
         try:
@@ -82,14 +99,28 @@ class SqlServer(core.database.server.Server):
 
         return res
 
-    def _list_fields(self, fields: List[Field], prefix=''):
-        res = ''
-        comma = False
-        for field in fields:
-            if comma:
-                res += ', '
-            comma = True
-            res += prefix + '[' + field.sqlname + ']'
+    def query_dataset(self, sql, parameters: list = None, stream=False, size=None):
+        cur = self._execute(sql, parameters)
+
+        columns = {}
+        i = 0
+        for col in cur.description:
+            columns[col[0]] = i
+            i += 1
+
+        res = core.database.server.Dataset(columns)
+        if stream:
+            res.extend(cur.fetchmany(self.dataset_size if size is None else size))
+            res.cursor = cur
+            self._stream = res
+            return res
+
+        while True:
+            rows = cur.fetchmany(self.dataset_size)
+            if not rows:
+                break
+            res.extend(rows)
+
         return res
 
     def _get_fieldtype(self, field: Field):
@@ -110,10 +141,19 @@ class SqlServer(core.database.server.Server):
             res += ' NOT NULL'
 
         elif field.type in [FieldType.DECIMAL]:
-            res += 'decimal(38,20)'
+            res += 'decimal(' + str(field.precision) + ',' + str(field.scale) + ')'
             res += ' NOT NULL'  
 
-        elif field.type in [FieldType.DATE, FieldType.DATETIME, FieldType.TIME]:
+        elif field.type in [FieldType.DATE]:
+            res += 'date'
+            res += ' NOT NULL'    
+
+        elif field.type in [FieldType.DATETIME]:
+            res += 'datetime2(3)'
+            res += ' NOT NULL'    
+
+        elif field.type in [FieldType.TIME]:
+            # time has no value left for the empty time sentinel, kept on datetime
             res += 'datetime'
             res += ' NOT NULL'    
 
@@ -121,43 +161,94 @@ class SqlServer(core.database.server.Server):
             res += 'int NOT NULL'
 
         elif field.type in [FieldType.BOOLEAN]:
-            res += 'tinyint NOT NULL'
+            res += 'bit NOT NULL'
 
         else:
             raise Exception(label('Unknown field type \'{0}\''.format(field.type[1])))
 
         return res
                 
-    def _process_table(self, table: core.object.table.Table):
-        sql = 'SELECT TOP 1 NULL FROM sysobjects WHERE (xtype = ?) AND (name = ?)'
-        if self.query(sql, ['U', table._sqlname]):
-            sql = 'SELECT c.is_identity, c.max_length, t.name AS typename, c.precision, c.scale, '
-            sql += 'c.name, c.is_nullable FROM sys.objects o, sys.columns c, sys.types t '
-            sql += 'WHERE (o.name = ?) AND (o.type = ?) AND (c.object_id = o.object_id) AND '
-            sql += '(c.system_type_id = t.system_type_id) AND (c.user_type_id = t.user_type_id)'
+    def schema_snapshot(self, tablename=None):
+        catalog = {}
+
+        sql = 'SELECT o.name AS tablename, c.is_identity, c.max_length, t.name AS typename, c.precision, c.scale, '
+        sql += 'c.name, c.is_nullable FROM sys.objects o, sys.columns c, sys.types t '
+        sql += 'WHERE (o.type = ?) AND (c.object_id = o.object_id) AND '
+        sql += '(c.system_type_id = t.system_type_id) AND (c.user_type_id = t.user_type_id)'
+        pars = ['U']
+        if tablename is not None:
+            sql += ' AND (o.name = ?)'
+            pars.append(tablename)
+
+        for row in self.query(sql, pars):
+            if row['tablename'] not in catalog:
+                catalog[row['tablename']] = {'columns': [], 'primarykey': [], 'indexes': {}}
+            catalog[row['tablename']]['columns'].append(row)
+
+        sql = 'SELECT o.name AS tablename, i.name AS indexname, i.is_primary_key, i.is_unique, x.is_included_column, c.name '
+        sql += 'FROM sys.objects o, sys.indexes i, sys.index_columns x, sys.columns c '
+        sql += 'WHERE (o.type = ?) AND (o.object_id = i.object_id) AND '
+        sql += '(x.object_id = o.object_id) AND (x.index_id = i.index_id) AND '
+        sql += '(c.object_id = o.object_id) AND (c.column_id = x.column_id)'
+        pars = ['U']
+        if tablename is not None:
+            sql += ' AND (o.name = ?)'
+            pars.append(tablename)
+        sql += ' ORDER BY o.name, i.name, x.is_included_column, x.key_ordinal, x.index_column_id'
+
+        idxs = {}
+        for row in self.query(sql, pars):
+            tab = row['tablename']
+            if tab not in catalog:
+                continue
 
-            tab = self.query(sql, [table._sqlname, 'U'])
+            if row['indexname'] == tab + '$PK':
+                catalog[tab]['primarykey'].append(row['name'])
+
+            # only secondary indexes managed by Core
+            elif (row['is_primary_key'] == 0) and row['indexname'].startswith(tab + '$'):
+                key = (tab, row['indexname'])
+                if key not in idxs:
+                    idxs[key] = {'unique': row['is_unique'] == 1, 'fields': [], 'include': []}
+                if row['is_included_column']:
+                    idxs[key]['include'].append(row['name'])
+                else:
+                    idxs[key]['fields'].append(row['name'])
+
+        for tab, name in idxs:
+            idx = idxs[(tab, name)]
+            catalog[tab]['indexes'][name] = self._get_indexdef(idx['unique'], idx['fields'], idx['include'])
+
+        return catalog
+
+    def _get_curdef(self, row):
+        """
+        Returns the definition of a column in the catalog, comparable with _get_fieldtype
+        """
+        curdef = row['typename']
+        if row['typename'] == 'nvarchar':
+            curdef += '(' + str(int(row['max_length'] / 2)) + ')'
+        elif row['typename'] == 'decimal':
+            curdef += '(' + str(row['precision']) + ',' + str(row['scale']) + ')'
+        elif row['typename'] == 'datetime2':
+            curdef += '(' + str(row['scale']) + ')'
+        if row['is_identity'] == 1:
+            curdef += ' IDENTITY(1,1)'
+        if row['is_nullable'] == 0:
+            curdef += ' NOT NULL'
+        return curdef
+
+    def _process_table(self, table: core.object.table.Table, entry, plan: list, changed: list):
+        if entry is not None:
+            tab = entry['columns']
 
             todelete = []
             toadd = []
-            tochange = []
 
             for field in table._fields:
                 ok = False
                 for row in tab:
                     if row['name'] == field.sqlname:
-                        newdef = self._get_fieldtype(field)
-                        curdef = row['typename']
-                        if row['typename'] == 'nvarchar':
-                            curdef += '(' + str(int(row['max_length'] / 2)) + ')'
-                        if row['is_identity'] == 1:
-                            curdef += ' IDENTITY(1,1)'
-                        if row['is_nullable'] == 0:
-                            curdef += ' NOT NULL'
-
-                        if newdef != curdef:
-                            tochange.append(field)
-
                         ok = True
                         break
                 
@@ -187,22 +278,22 @@ class SqlServer(core.database.server.Server):
                     sql += '0'
                 elif field.type in [FieldType.DATE, FieldType.DATETIME, FieldType.TIME]:
                     sql += '\'17530101\''                    
-                self.execute(sql)
+                plan.append((sql, False))
 
                 sql = 'ALTER TABLE [' + table._sqlname + '] '
                 sql += 'DROP CONSTRAINT [' + field.sqlname + '$DEF]'
-                self.execute(sql)
+                plan.append((sql, False))
 
             for row in todelete:
                 sql = 'ALTER TABLE [' + table._sqlname + '] '
                 sql += 'DROP COLUMN [' + row['name'] + ']'
-                self.execute(sql)
+                plan.append((sql, True))
 
-            for field in tochange:
+            for field in changed:
                 sql = 'ALTER TABLE [' + table._sqlname + '] '
                 sql += 'ALTER COLUMN [' + field.sqlname + '] '
                 sql += self._get_fieldtype(field)
-                self.execute(sql)
+                plan.append((sql, True))
 
         else:
             sql = 'CREATE TABLE [' + table._sqlname + '] ('
@@ -210,369 +301,401 @@ class SqlServer(core.database.server.Server):
                 sql += '[' + field.sqlname + '] ' + self._get_fieldtype(field) + ', '
             sql += '[timestamp] timestamp'
             sql += ')'
-            self.execute(sql)
+            plan.append((sql, False))
 
-    def _process_primarykey(self, table: core.object.table.Table):
-        sql = 'SELECT c.name FROM sys.objects o, sys.indexes i, sys.index_columns x, sys.columns c '
-        sql += 'WHERE (o.name = ?) AND (o.type = ?) AND (o.object_id = i.object_id) AND (i.name = ?) AND '
-        sql += '(x.object_id = o.object_id) AND (x.index_id = i.index_id) AND (c.object_id = o.object_id) AND '
-        sql += '(c.column_id = x.column_id) ORDER BY x.key_ordinal'
-
-        tab = self.query(sql, [table._sqlname, 'U', table._sqlname + '$PK'])
+    def _process_primarykey(self, table: core.object.table.Table, entry, plan: list, drop: bool, changed: list):
+        """
+        Drop (before columns are changed) or add (after) the primary key of the table
+        """
         curpk = ''
-        for row in tab:
-            curpk += row['name'] + ', '
+        if entry is not None:
+            for name in entry['primarykey']:
+                curpk += name + ', '
 
         newpk = ''
         for fld in table._primarykey:
             newpk += fld.sqlname + ', '
 
-        if curpk == newpk:
-            return
-
-        if curpk > '':
-            sql = 'ALTER TABLE [' + table._sqlname + '] '
-            sql += 'DROP CONSTRAINT [' + table._sqlname + '$PK]'
-            self.execute(sql)
-
-        if newpk > '':
-            sql = 'ALTER TABLE [' + table._sqlname + '] '
-            sql += 'ADD CONSTRAINT [' + table._sqlname + '$PK] '
-            sql += 'PRIMARY KEY ('
-            sql += self._list_fields(table._primarykey)
-            sql += ')'
-            self.execute(sql)
-
-    def table_compile(self, table: core.object.table.Table):
-        if not table._primarykey:
-            table._error_noprimarykey()
-
-        self._process_table(table)
-
-        self._process_primarykey(table)
-
-    def from_sqlvalue(self, field: Field, value):
-        res = None
-        if field.type in [FieldType.CODE, FieldType.TEXT, FieldType.INTEGER, FieldType.BIGINTEGER, FieldType.OPTION]:
-            res = value
+        # columns of the primary key cannot be altered
+        rebuild = False
+        for fld in table._primarykey:
+            if fld in changed:
+                rebuild = True
 
-        elif field.type == FieldType.DECIMAL:
-            res = value.normalize()
+        if (curpk == newpk) and (not rebuild):
+            return
 
-        elif field.type == FieldType.BOOLEAN:
-            res = True if value == 1 else False
+        if drop:
+            if curpk > '':
+                sql = 'ALTER TABLE [' + table._sqlname + '] '
+                sql += 'DROP CONSTRAINT [' + table._sqlname + '$PK]'
+                plan.append((sql, False))
 
-        elif field.type == FieldType.DATETIME:
-            if value == datetime(1753, 1, 1):
-                res = None
-            else:
-                value = value.replace(tzinfo=dateutil.tz.UTC)
-                res = value.astimezone(core.session.Session.timezone)
+        else:
+            if newpk > '':
+                sql = 'ALTER TABLE [' + table._sqlname + '] '
+                sql += 'ADD CONSTRAINT [' + table._sqlname + '$PK] '
+                sql += 'PRIMARY KEY ('
+                sql += self._list_fields(table._primarykey)
+                sql += ')'
+                plan.append((sql, False))
+
+    def _process_indexes(self, table: core.object.table.Table, entry, plan: list, drop: bool, changed: list):
+        """
+        Drop (before columns are changed) or create (after) the secondary indexes of the table
+        """
+        curidx = entry['indexes'] if entry is not None else {}
+
+        newidx = {}
+        for name in table._indexes:
+            newidx[table._sqlname + '$' + Convert.to_sqlname(name)] = table._indexes[name]
+
+        # indexes are rebuilt if changed or if any of their columns is altered
+        keep = []
+        for name in newidx:
+            idx = newidx[name]
+            if name not in curidx:
+                continue
+            if curidx[name] != self._get_indexdef(idx['unique'], [f.sqlname for f in idx['fields']],
+                                                  [f.sqlname for f in idx['include']]):
+                continue
 
-        elif field.type == FieldType.DATE:
-            if value == datetime(1753, 1, 1):
-                res = None
-            else:
-                res = value.date()
+            ok = True
+            for fld in idx['fields'] + idx['include']:
+                if fld in changed:
+                    ok = False
+            if ok:
+                keep.append(name)
 
-        elif field.type == FieldType.TIME:
-            if value == datetime(1753, 1, 1):
-                res = None
-            else:
-                res = value.time()
+        if drop:
+            for name in curidx:
+                if name not in keep:
+                    plan.append(('DROP INDEX [' + name + '] ON [' + table._sqlname + ']', False))
 
         else:
-            raise Exception(label('Unknown field type \'{0}\''.format(field.type[1])))
+            for name in newidx:
+                if name in keep:
+                    continue
 
-        return res
+                idx = newidx[name]
+                sql = 'CREATE '
+                if idx['unique']:
+                    sql += 'UNIQUE '
+                sql += 'INDEX [' + name + '] ON [' + table._sqlname + '] ('
+                sql += self._list_fields(idx['fields'])
+                sql += ')'
+                if idx['include']:
+                    sql += ' INCLUDE (' + self._list_fields(idx['include']) + ')'
+                plan.append((sql, False))
+
+    def table_compile(self, table: core.object.table.Table, catalog: dict = None, check=False):
+        if not table._primarykey:
+            table._error_noprimarykey()
 
-    def to_sqlvalue(self, field: Field, value):
-        res = None
-        if field.type in [FieldType.CODE, FieldType.TEXT, FieldType.INTEGER, FieldType.BIGINTEGER, FieldType.DECIMAL, FieldType.OPTION]:
-            res = value
+        if catalog is None:
+            catalog = self.schema_snapshot(table._sqlname)
+        entry = catalog.get(table._sqlname)
 
-        elif field.type == FieldType.BOOLEAN:
-            res = 1 if value else 0
+        plan = []
+        changed = self._get_changedfields(table, entry)
+        self._process_indexes(table, entry, plan, True, changed)
+        self._process_primarykey(table, entry, plan, True, changed)
+        self._process_table(table, entry, plan, changed)
+        self._process_primarykey(table, entry, plan, False, changed)
+        self._process_indexes(table, entry, plan, False, changed)
 
-        elif field.type == FieldType.DATETIME:
-            if value is None:
-                res = date(1753, 1, 1)
-            else:
-                res = value.astimezone(dateutil.tz.UTC)
+        if not check:
+            for sql, disruptive in plan:
+                self.execute(sql)
 
-        elif field.type == FieldType.DATE:
+        return plan
+
+    def _get_fromsql(self):
+        """
+        Returns the converters from sql value by field type, resolved once per session timezone
+        """
+        tz = core.session.Session.timezone
+        if (self._fromsql is not None) and (self._fromsql_tz is tz):
+            return self._fromsql
+
+        nulldate = datetime(1753, 1, 1)
+        nulldate_date = date(1753, 1, 1)
+        utc = dateutil.tz.UTC
+
+        def from_decimal(value):
+            return value.normalize()
+
+        def from_boolean(value):
+            return bool(value)
+
+        def from_datetime(value):
+            if value == nulldate:
+                return None
+            return value.replace(tzinfo=utc).astimezone(tz)
+
+        def from_date(value):
+            if value == nulldate_date:
+                return None
+            return value
+
+        def from_time(value):
+            if value == nulldate:
+                return None
+            return value.time()
+
+        self._fromsql = {
+            FieldType.CODE: _same,
+            FieldType.TEXT: _same,
+            FieldType.INTEGER: _same,
+            FieldType.BIGINTEGER: _same,
+            FieldType.OPTION: _same,
+            FieldType.DECIMAL: from_decimal,
+            FieldType.BOOLEAN: from_boolean,
+            FieldType.DATETIME: from_datetime,
+            FieldType.DATE: from_date,
+            FieldType.TIME: from_time
+        }
+        self._fromsql_tz = tz
+        return self._fromsql
+
+    @staticmethod
+    def _get_tosql():
+        """
+        Returns the converters to sql value by field type
+        """
+        nulldate = date(1753, 1, 1)
+        utc = dateutil.tz.UTC
+        basedate = date(1754, 1, 1)
+
+        def to_boolean(value):
+            return bool(value)
+
+        def to_datetime(value):
             if value is None:
-                res = date(1753, 1, 1)
-            else:
-                res = datetime.combine(value, time(0, 0, 0))
+                return nulldate
+            return value.astimezone(utc)
 
-        elif field.type == FieldType.TIME:
+        def to_date(value):
             if value is None:
-                res = date(1753, 1, 1)
-            else:
-                res = datetime.combine(date(1754, 1, 1), value)
-
-        else:
-            raise Exception(label('Unknown field type \'{0}\''.format(field.type[1])))
+                return nulldate
+            return value
 
-        return res
+        def to_time(value):
+            if value is None:
+                return nulldate
+            return datetime.combine(basedate, value)
+
+        return {
+            FieldType.CODE: _same,
+            FieldType.TEXT: _same,
+            FieldType.INTEGER: _same,
+            FieldType.BIGINTEGER: _same,
+            FieldType.DECIMAL: _same,
+            FieldType.OPTION: _same,
+            FieldType.BOOLEAN: to_boolean,
+            FieldType.DATETIME: to_datetime,
+            FieldType.DATE: to_date,
+            FieldType.TIME: to_time
+        }
 
-    def _set_rowversion(self, table: core.object.table.Table):
-        table._rowversion = self.query('SELECT @@DBTS [dbts]')[0]['dbts']
-            
     def table_insert(self, table: core.object.table.Table):
-        pars = []
-        places = []
-
-        identity_field = None
-        identity_insert = False
-        fields = []
-        for field in table._fields:
-            if field.type in [FieldType.INTEGER, FieldType.BIGINTEGER]:
-                if field.autoincrement:
-                    identity_field = field
-                    if field.value == 0:
-                        continue
-                    else:
-                        identity_insert = True
-
-            fields.append(field)
-            places.append('?')
-            pars.append(self.to_sqlvalue(field, field.value))
-
-        sql = 'INSERT INTO [' + table._sqlname + '] ('
-        sql += self._list_fields(fields)
-        sql += ') VALUES ('
-        sql += ', '.join(places)
-        sql += ')'
-
-        if identity_insert:
-            self.execute('SET IDENTITY_INSERT [' + table._sqlname + '] ON')
-
-        self.execute(sql, pars)
-        self._set_rowversion(table)
-
-        if identity_insert:
-            self.execute('SET IDENTITY_INSERT [' + table._sqlname + '] OFF')
-        elif identity_field is not None:
-            identity_field.value = self.query('SELECT @@IDENTITY AS [id]')[0]['id']
+        identity_index = self._get_identity(table)
+        identity_insert = (identity_index is not None) and (table._fields[identity_index].value != 0)
 
-    def table_modify(self, table: core.object.table.Table):
-        pars = []
-
-        fields = []
-        for field in table._fields:
-            if field in table._primarykey:
-                continue
-            if field.value == field.xvalue:
-                continue
-            fields.append(field)
-
-        if not fields:
-            return
-
-        sql = 'UPDATE [' + table._sqlname + '] SET '
+        key = (table.__class__, 'insert', identity_insert)
+        stmt = self._statements.get(key)
+        if stmt is None:
+            stmt = core.database.server.Statement('')
+            for i in range(len(table._fields)):
+                if (i != identity_index) or identity_insert:
+                    stmt.fields.append(i)
 
-        comma = False
-        for field in fields:
-            if comma:
-                sql += ', '
-            comma = True
-            sql += '[' + field.sqlname + '] = ?'
-            pars.append(self.to_sqlvalue(field, field.value))
+            output = ['timestamp']
+            if identity_index is not None:
+                output.append(table._fields[identity_index].sqlname)
+            node = core.database.dialect.Insert(table._sqlname, [table._fields[i].sqlname for i in stmt.fields],
+                                                output=output)
 
-        sql += ' WHERE '
-        sql += self._get_wherepk(table, pars)
+            sql = 'SET NOCOUNT ON; '
+            if identity_insert:
+                sql += 'SET IDENTITY_INSERT [' + table._sqlname + '] ON; '
 
-        n = self.execute(sql, pars)
-        if n != 1:
-            table._error_concurrency()
-        self._set_rowversion(table)
+            sql += self.dialect.render(node) + '; '
 
-    def table_delete(self, table: core.object.table.Table):
-        pars = []
-        sql = 'DELETE FROM [' + table._sqlname + '] WHERE '
-        sql += self._get_wherepk(table, pars)
+            if identity_insert:
+                sql += 'SET IDENTITY_INSERT [' + table._sqlname + '] OFF; '
+            sql += 'SET NOCOUNT OFF'
 
-        n = self.execute(sql, pars)
-        if n != 1:
-            table._error_concurrency()
+            stmt.sql = sql
+            self._statements[key] = stmt
 
-    def _get_wherepk(self, table: core.object.table.Table, pars, with_timestamp=True):
-        sql = ''
-
-        comma = False
-        for field in table._primarykey:
-            if comma:
-                sql += ' AND '
-            comma = True
-            sql += '([' + field.sqlname + '] = ?)'
-            pars.append(self.to_sqlvalue(field, field.value))
-
-        if with_timestamp:
-            sql += ' AND ([timestamp] <= ?)'
-            pars.append(table._rowversion)
-
-        return sql
-
-    def _get_where(self, table: core.object.table.Table, pars):
-        # split by levels to allow OR instead of AND join
-        modes = {}
-        fltrs = {}
-        for field in table._fields:
-            for flt in field.filters:
-                if flt.level not in fltrs:
-                    fltrs[flt.level] = []
-                    if flt.level in table._filterlevelmode:
-                        modes[flt.level] = table._filterlevelmode[flt.level]
-                    else:
-                        modes[flt.level] = 'AND'
-                fltrs[flt.level].append(flt)
-
-        where = []
-        for l in fltrs:
-            levwh = []
-            for flt in fltrs[l]:
-                if flt.type == 'equal':
-                    levwh.append('([' + flt.field.sqlname + '] = ?)')
-                    pars.append(self.to_sqlvalue(flt.field, flt.value))
-
-                elif flt.type == 'range':
-                    levwh.append('([' + flt.field.sqlname + '] BETWEEN ? AND ?)')
-                    pars.append(self.to_sqlvalue(flt.field, flt.min_value))
-                    pars.append(self.to_sqlvalue(flt.field, flt.max_value))
-
-                elif flt.type == 'expr':
-                    vals = []
-                    left_name = '[' + flt.field.sqlname + ']'
-                    levwh.append('(' + flt.tosql(vals, left_name=left_name) + ')')
-                    for v in vals:
-                        pars.append(self.to_sqlvalue(flt.field, v))
-
-            mode = ' ' + modes[l] + ' '
-            where.append('(' + mode.join(levwh) + ')')
-
-        return where
-
-    def _table_findset(self, *, table: core.object.table.Table, size=None, offset=None, nextset=False, ascending=None, pk=None):
         pars = []
-        if ascending is None:
-            ascending = table._ascending
-
-        sql = 'SELECT '
-
-        for field in table._fields:
-            sql += '[' + field.sqlname + '], '
-
-        sql += '[timestamp] FROM [' + table._sqlname + ']'
-        if table._locktable:
-            sql += ' WITH (UPDLOCK)'
-        else:
-            sql += ' WITH (READUNCOMMITTED)'
-
-        where = []
-        if pk:
-            i = 0
-            for field in table._primarykey:
-                where.append('([' + field.sqlname + '] = ?)')
-                pars.append(self.to_sqlvalue(field, pk[i]))
-                i += 1
-
-        else:
-            if nextset:
-                k = len(table._currentkey)
-                l = k
-                wn = []
-                for i in range(0, k):
-                    ws = []
-                    for j in range(0, l):
-                        field = table._currentkey[j]
-                        op = ('>' if ascending else '<') if j == (l - 1) else '='
-                        ws.append('([' + field.sqlname + '] ' + op + ' ?)')
-                        pars.append(self.to_sqlvalue(field, field.value))
-
-                    wn.append('(' + ' AND '.join(ws) + ')')
-                    l -= 1
-
-                where.append('(' + ' OR '.join(wn) + ')')
-
-            where += self._get_where(table, pars)
-
-        if where:
-            sql += ' WHERE ' + ' AND '.join(where)
-
-        if not pk:
-            sql += ' ORDER BY '
-            comma = False
-            for field in table._currentkey:
-                if comma:
-                    sql += ', '
-                comma = True
-                sql += '[' + field.sqlname + ']'
-                if not ascending:
-                    sql += ' DESC'
-
-            if offset is None:
-                offset = 0
-            
-            if size is None:
-                size = self.dataset_size
-
-            sql += ' OFFSET ' + str(offset) + ' ROWS FETCH FIRST ' + str(size) + ' ROWS ONLY'
-
-        return self.query(sql, pars)
-
-    def table_get(self, table: core.object.table.Table, pk):
-        return self._table_findset(table=table, pk=pk)
+        for i in stmt.fields:
+            field = table._fields[i]
+            pars.append(self._tosql[field.type](field.value))
+
+        row = self._fetch_output(stmt.sql, pars)[0]
+        table._rowversion = row[0]
+        if (identity_index is not None) and (not identity_insert):
+            table._fields[identity_index].value = row[1]
+
+    def _fetch_output(self, sql, parameters: list = None):
+        """
+        Execute a batch and returns the rows of the first result set (OUTPUT clause)
+        """
+        cur = self._execute(sql, parameters)
+        while cur.description is None:
+            if not cur.nextset():
+                return []
 
-    def table_findset(self, table: core.object.table.Table, size=None, offset=None):
-        return self._table_findset(table=table, size=size, offset=offset)
+        return cur.fetchall()
 
-    def table_nextset(self, table: core.object.table.Table):
-        return self._table_findset(table=table, nextset=True)
+    def table_insertall(self, table: core.object.table.Table, records: list):
+        if not records:
+            return
 
-    def table_findfirst(self, table: core.object.table.Table):
-        return self._table_findset(table=table, size=1)
+        identity_index = self._get_identity(table)
 
-    def table_findlast(self, table: core.object.table.Table):
-        return self._table_findset(table=table, size=1, ascending=not (table._ascending ^ False))
+        # records with an explicit identity value require IDENTITY_INSERT, so they are sent apart
+        generated = []
+        explicit = []
+        for rec in records:
+            if rec.__class__ is not table.__class__:
+                raise Exception(label('Record \'{0}\' cannot be inserted in \'{1}\''.format(rec._caption, table._caption)))
 
-    def table_loadrow(self, table: core.object.table.Table, row: dict):
-        for field in table._fields:
-            field.value = self.from_sqlvalue(field, row[field.sqlname])
-        
-        table._rowversion = row['timestamp']
+            if (identity_index is not None) and (rec._fields[identity_index].value != 0):
+                explicit.append(rec)
+            else:
+                generated.append(rec)
 
-    def table_isempty(self, table: core.object.table.Table):
-        pars = []
-        sql = 'SELECT TOP 1 NULL [ne] FROM [' + table._sqlname + '] WITH (READUNCOMMITTED)'
+        for recs, identity_insert in [(generated, False), (explicit, True)]:
+            if not recs:
+                continue
 
-        where = self._get_where(table, pars)
-        if where:
-            sql += ' WHERE ' + ' AND '.join(where)
+            indexes = []
+            for i in range(len(table._fields)):
+                if (i != identity_index) or identity_insert:
+                    indexes.append(i)
+
+            batch_size = min(self._max_rows, self._max_parameters // (len(indexes) + 1))
+            for start in range(0, len(recs), batch_size):
+                self._insert_batch(table, recs[start:start + batch_size], indexes, identity_index, identity_insert)
+
+    def _insert_batch(self, table: core.object.table.Table, records: list, indexes: list, identity_index, identity_insert):
+        """
+        Insert a batch of records with a single MERGE statement, returning rowversion and identity
+        """
+        key = (table.__class__, 'insertall', identity_insert, len(records))
+        stmt = self._statements.get(key)
+        if stmt is None:
+            fields = [table._fields[i] for i in indexes]
+            places = ['(' + ', '.join(['?'] * (len(indexes) + 1)) + ')'] * len(records)
+
+            sql = 'SET NOCOUNT ON; '
+            if identity_insert:
+                sql += 'SET IDENTITY_INSERT [' + table._sqlname + '] ON; '
+
+            # MERGE (unlike INSERT) can OUTPUT source columns, binding each new row to its record
+            sql += 'MERGE INTO [' + table._sqlname + '] USING (VALUES '
+            sql += ', '.join(places)
+            sql += ') AS [src] ([$seq], ' + self._list_fields(fields) + ') ON 1 = 0 '
+            sql += 'WHEN NOT MATCHED THEN INSERT (' + self._list_fields(fields) + ') '
+            sql += 'VALUES (' + self._list_fields(fields, '[src].') + ') '
+            sql += 'OUTPUT [src].[$seq], inserted.[timestamp]'
+            if identity_index is not None:
+                sql += ', inserted.[' + table._fields[identity_index].sqlname + ']'
+            sql += '; '
+
+            if identity_insert:
+                sql += 'SET IDENTITY_INSERT [' + table._sqlname + '] OFF; '
+            sql += 'SET NOCOUNT OFF'
+
+            stmt = core.database.server.Statement(sql, indexes)
+            self._statements[key] = stmt
 
-        if not self.query(sql, pars):
-            return True
-        else:
-            return False   
-
-    def table_count(self, table: core.object.table.Table):
         pars = []
-        sql = 'SELECT COUNT(*) [c] FROM [' + table._sqlname + '] WITH (READUNCOMMITTED)'
+        for seq, rec in enumerate(records):
+            pars.append(seq)
+            for i in stmt.fields:
+                field = rec._fields[i]
+                pars.append(self._tosql[field.type](field.value))
+
+        for row in self._fetch_output(stmt.sql, pars):
+            rec = records[row[0]]
+            rec._rowversion = row[1]
+            if (identity_index is not None) and (not identity_insert):
+                rec._fields[identity_index].value = row[2]
 
-        where = self._get_where(table, pars)
-        if where:
-            sql += ' WHERE ' + ' AND '.join(where)
+    def table_modify(self, table: core.object.table.Table):
+        changed = self._get_changed(table)
+        if not changed:
+            return
 
-        qry = self.query(sql, pars)
-        return qry[0]['c']
+        stmt = self._get_modify(table, changed)
 
-    def table_deleteall(self, table: core.object.table.Table):            
         pars = []
-        sql = 'DELETE FROM [' + table._sqlname + ']'  
+        self._bind_modify(table, stmt, pars)
 
-        where = self._get_where(table, pars)
-        if where:
-            sql += ' WHERE ' + ' AND '.join(where)
-
-        self.execute(sql, pars)
+        rows = self._fetch_output(stmt.sql, pars)
+        if len(rows) != 1:
+            table._error_concurrency()
+        table._rowversion = rows[0][0]
+
+    def _get_modify(self, table: core.object.table.Table, changed):
+        """
+        Returns the cached UPDATE statement of the changed fields (positions)
+        """
+        key = (table.__class__, 'modify', tuple(changed))
+        stmt = self._statements.get(key)
+        if stmt is None:
+            node = core.database.dialect.Update(table._sqlname, [table._fields[i].sqlname for i in changed],
+                                                [self._get_wherepk(table)], ['timestamp'])
+
+            stmt = core.database.server.Statement(self.dialect.render(node), changed)
+            self._statements[key] = stmt
+
+        return stmt
+
+    def _bind_modify(self, table: core.object.table.Table, stmt, pars):
+        for i in stmt.fields:
+            field = table._fields[i]
+            pars.append(self._tosql[field.type](field.value))
+        self._bind_wherepk(table, pars)
+
+    def table_modifyrows(self, table: core.object.table.Table, records: list):
+        # records with the same changed fields are sent in batches of UPDATE statements, one result set each
+        groups = {}
+        for rec in records:
+            changed = self._get_changed(rec)
+            if changed:
+                groups.setdefault(tuple(changed), []).append(rec)
+
+        for changed, recs in groups.items():
+            stmt = self._get_modify(table, changed)
+            batch_size = min(self._max_rows, self._max_parameters // (len(changed) + len(table._primarykey) + 1))
+            for start in range(0, len(recs), batch_size):
+                batch = recs[start:start + batch_size]
+
+                sql = 'SET NOCOUNT ON; '
+                sql += '; '.join([stmt.sql] * len(batch))
+                sql += '; SET NOCOUNT OFF'
+
+                pars = []
+                for rec in batch:
+                    self._bind_modify(rec, stmt, pars)
+
+                cur = self._execute(sql, pars)
+                for i, rec in enumerate(batch):
+                    if i > 0:
+                        cur.nextset()
+                    rows = cur.fetchall()
+                    if len(rows) != 1:
+                        rec._error_concurrency()
+                    rec._rowversion = rows[0][0]
+
+    def table_modifyall(self, table: core.object.table.Table, field: Field, value):
+        node = core.database.dialect.Update(table._sqlname, [field.sqlname])
+        stmt, pars = self._get_filtered(table, ('modifyall', field.sqlname), node)
+
+        pars.insert(0, self._tosql[field.type](value))
+        self.execute(stmt.sql, pars)
@@ -7,9 +7,11 @@ class Decimal(Field):
     """
     Field of type DECIMAL
     """    
-    def __init__(self, name, caption):
+    def __init__(self, name, caption, precision=38, scale=20):
         super().__init__()
         self.type = FieldType.DECIMAL
+        self.precision = precision
+        self.scale = scale
         self.name = name
         self.caption = caption
         self.sqlname = Convert.to_sqlname(name)
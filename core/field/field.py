@@ -31,10 +31,103 @@ class FieldType(Option):
     TIME = 10, label('Time')
 
 
+def _fold(value):
+    """
+    Returns the value compared as the database does, text is case insensitive
+    """
+    return value.upper() if isinstance(value, str) else value
+
+
+class FilterTerm:
+    """
+    Condition on the field value of a filter expression: op is =, <>, <, >, <=, >=, BETWEEN or LIKE
+    """
+    def __init__(self, op, values: list):
+        self.op = op
+        self.values = values
+        self._keys = [_fold(v) for v in values]
+        self._pattern = None
+
+        if op == 'LIKE':
+            rgx = ''
+            for c in str(values[0]):
+                if c == '%':
+                    rgx += '.*'
+                elif c == '_':
+                    rgx += '.'
+                else:
+                    rgx += re.escape(c)
+            self._pattern = re.compile(rgx, re.IGNORECASE | re.DOTALL)
+
+    def shape(self):
+        return self.op
+
+    def tosql(self, left, pars, left_value=None):
+        if left_value is not None:
+            pars.append(left_value)
+        pars += self.values
+
+        if self.op == 'BETWEEN':
+            return '(' + left + ' BETWEEN ? AND ?)'
+        else:
+            return '(' + left + ' ' + self.op + ' ?)'
+
+    def match(self, value):
+        if self.op == 'LIKE':
+            return (value is not None) and (self._pattern.fullmatch(str(value)) is not None)
+
+        value = _fold(value)
+        try:
+            if self.op == 'BETWEEN':
+                return self._keys[0] <= value <= self._keys[1]
+            elif self.op == '=':
+                return value == self._keys[0]
+            elif self.op == '<>':
+                return value != self._keys[0]
+            elif self.op == '<':
+                return value < self._keys[0]
+            elif self.op == '>':
+                return value > self._keys[0]
+            elif self.op == '<=':
+                return value <= self._keys[0]
+            else:
+                return value >= self._keys[0]
+
+        except TypeError:
+            # None (or other type) never matches a range
+            return False
+
+
+class FilterGroup:
+    """
+    Terms of a filter expression joined by AND (&) or OR (|)
+    """
+    def __init__(self, op, items: list):
+        self.op = op
+        self.items = items
+
+    def shape(self):
+        return self.op, tuple(item.shape() for item in self.items)
+
+    def tosql(self, left, pars, left_value=None):
+        sql = [item.tosql(left, pars, left_value) for item in self.items]
+        return '(' + (' ' + self.op + ' ').join(sql) + ')'
+
+    def match(self, value):
+        if self.op == 'AND':
+            return all(item.match(value) for item in self.items)
+        else:
+            return any(item.match(value) for item in self.items)
+
+
 class FieldFilter:
     """
     Filter implementation
+    Expressions are parsed once into a tree of FilterGroup and FilterTerm, rendered to SQL (tosql)
+    or evaluated on a value (match)
     """
+    _tokens = re.compile(r'([()&|])')
+
     def __init__(self):
         self.level = 0
         self.type = ''
@@ -45,73 +138,142 @@ class FieldFilter:
         self.expression = ''
         self.field = None  # type: Field
 
-        self._leftnam = ''
-        self._leftval = None
+        self._ast = None
         self._pars = []
 
-    def _addpars(self, value):
-        if value.startswith('{') and value.endswith('}'):
-            idx = int(value[1:-1])
-            self._pars.append(self.values[idx])
-
-        else:
-            self._pars.append(self.field.evaluate(value))
-
-    def _replace(self, match):
-        val = match.groups(0)[0]
-        val = val.strip()
-
-        if self._leftval is not None:
-            self._pars.append(self._leftval)
-
+    def _getast(self):
+        """
+        Returns the parsed expression, literals are evaluated by the field once
+        """
+        if self._ast is None:
+            tokens = [t.strip() for t in self._tokens.split(self.expression)]
+            tokens = [t for t in tokens if t]
+            ast, pos = self._parse_or(tokens, 0)
+            if pos < len(tokens):
+                self._error_invalid()
+
+            pars = []
+            ast.tosql('', pars)
+            self._ast = ast
+            self._pars = pars
+
+        return self._ast
+
+    def _parse_or(self, tokens, pos):
+        items = []
+        item, pos = self._parse_and(tokens, pos)
+        items.append(item)
+        while (pos < len(tokens)) and (tokens[pos] == '|'):
+            item, pos = self._parse_and(tokens, pos + 1)
+            items.append(item)
+
+        return (items[0] if len(items) == 1 else FilterGroup('OR', items)), pos
+
+    def _parse_and(self, tokens, pos):
+        items = []
+        item, pos = self._parse_atom(tokens, pos)
+        items.append(item)
+        while (pos < len(tokens)) and (tokens[pos] == '&'):
+            item, pos = self._parse_atom(tokens, pos + 1)
+            items.append(item)
+
+        return (items[0] if len(items) == 1 else FilterGroup('AND', items)), pos
+
+    def _parse_atom(self, tokens, pos):
+        if pos >= len(tokens):
+            self._error_invalid()
+
+        if tokens[pos] == '(':
+            item, pos = self._parse_or(tokens, pos + 1)
+            if (pos >= len(tokens)) or (tokens[pos] != ')'):
+                self._error_invalid()
+            return item, pos + 1
+
+        if tokens[pos] in ['|', '&', ')']:
+            self._error_invalid()
+
+        return self._parse_term(tokens[pos]), pos + 1
+
+    def _parse_term(self, val):
         if '..' in val:
             bt = val.split('..')
             if (bt[0] > '') and (bt[1] > ''):
-                self._addpars(bt[0])
-                self._addpars(bt[1])
-                return '(' + self._leftnam + ' BETWEEN ? AND ?)'
+                return FilterTerm('BETWEEN', [self._evaluate(bt[0]), self._evaluate(bt[1])])
 
             elif bt[0] > '':
-                self._addpars(bt[0])
-                return '(' + self._leftnam + ' >= ?)'
+                return FilterTerm('>=', [self._evaluate(bt[0])])
 
             elif bt[1] > '':
-                self._addpars(bt[1])
-                return '(' + self._leftnam + ' <= ?)'
+                return FilterTerm('<=', [self._evaluate(bt[1])])
+
+            else:
+                self._error_invalid()
 
         elif '*' in val:
-            self._addpars(val.replace('*', '%'))
-            return '(' + self._leftnam + ' LIKE ?)'
-        
+            return FilterTerm('LIKE', [self._evaluate(val.replace('*', '%'))])
+
         elif val[0:2] in ['<>', '>=', '<=']:
-            self._addpars(val[2:])
-            return '(' + self._leftnam + ' ' + val[0:2] + ' ?)'
+            return FilterTerm(val[0:2], [self._evaluate(val[2:])])
 
         elif val[0:1] in ['<', '>', '=']:
-            self._addpars(val[1:])
-            return '(' + self._leftnam + ' ' + val[0:1] + ' ?)'
-        
+            return FilterTerm(val[0:1], [self._evaluate(val[1:])])
+
         else:
-            self._addpars(val)
-            return '(' + self._leftnam + ' = ?)'
+            return FilterTerm('=', [self._evaluate(val)])
+
+    def _evaluate(self, value):
+        if value.startswith('{') and value.endswith('}'):
+            idx = int(value[1:-1])
+            return self.values[idx]
+
+        else:
+            return self.field.evaluate(value)
+
+    def _error_invalid(self):
+        raise Exception(label('Invalid filter \'{0}\' on \'{1}\''.format(self.expression, self.field.caption)))
 
     def tosql(self, pars, left_name=None, left_value=None):
+        """
+        Returns the SQL condition of the expression on the column left_name (or on the parameter left_value)
+        """
+        ast = self._getast()
         if left_value is not None:
-            self._leftnam = '?'
-            self._leftval = left_value
+            return ast.tosql('?', pars, left_value)
         else:
-            self._leftnam = left_name
-            self._leftval = None
+            return ast.tosql(left_name, pars)
 
-        self._pars.clear()
+    def shape(self):
+        """
+        Returns the structure of the expression (operators without values), the SQL of tosql depends only on it
+        """
+        if self.type == 'expr':
+            return self._getast().shape()
+        return None
 
-        rgx = re.compile(r'([^()&|]+)')
-        sql = rgx.sub(self._replace, self.expression)
-        sql = sql.replace('|', ' OR ')
-        sql = sql.replace('&', ' AND ')
+    def parameters(self):
+        """
+        Returns the parameters of tosql, in binding order
+        """
+        self._getast()
+        return self._pars
 
-        pars += self._pars
-        return sql
+    def match(self, value):
+        """
+        Returns True if the value satisfies the filter, as the database would
+        """
+        if self.type == 'equal':
+            return _fold(value) == _fold(self.value)
+
+        elif self.type == 'range':
+            try:
+                return _fold(self.min_value) <= _fold(value) <= _fold(self.max_value)
+            except TypeError:
+                return False
+
+        elif self.type == 'expr':
+            return self._getast().match(value)
+
+        return True
 
 
 class Field:
@@ -172,6 +334,13 @@ class Field:
         self.value = self.initvalue
         self.xvalue = self.initvalue
 
+    def _load(self, value):
+        """
+        Set value and xvalue from the database, bypassing checkvalue (value is trusted)
+        """
+        self.__dict__['value'] = value
+        self.__dict__['xvalue'] = value
+
     def evaluate(self, strval):
         """
         Try to transform string to field value
@@ -301,6 +470,7 @@ class Field:
         flt.values = values
         flt.expression = expression
         flt.field = self
+        flt._getast()
         self.filters.append(flt)
 
     def setrange(self, minvalue=None, maxvalue=None):
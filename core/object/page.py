@@ -29,6 +29,7 @@ class Page(Unit):
         self._insertallowed = True
         self._modifyallowed = True
         self._deleteallowed = True
+        self._deletebatch = False
         self._readonly = False
         self._islist = False
         self._opennew = False
@@ -366,9 +367,19 @@ class Page(Unit):
         if not Client.confirm(label('Delete {0} {1}?'.format(len(self._selectedrows), self.rec._caption))):
             return
 
-        for i in self._selectedrows:
-            self.rec.get(*self._getrowpk(i))
-            self.rec.delete(True)
+        if self._deletebatch:
+            # triggers run for all selected rows, then the rows are deleted at once
+            rows = []
+            for i in self._selectedrows:
+                self.rec.get(*self._getrowpk(i))
+                self.rec._ondelete()
+                rows.append((self.rec.getposition(), self.rec._rowversion))
+            self.rec._deleterows(rows)
+
+        else:
+            for i in self._selectedrows:
+                self.rec.get(*self._getrowpk(i))
+                self.rec.delete(True)
 
         newds = []
         newfds = []
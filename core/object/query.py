@@ -0,0 +1,191 @@
+import copy
+from typing import List
+from core.object.unit import Unit
+from core.object.unit import UnitType
+from core.field.field import Field, FieldType
+from core.field.integer import Integer
+from core.language import label
+import core.session
+import core.object.table
+
+
+class DataItem:
+    """
+    Table read by a query, joined to a previous data item through the relations of their fields
+    """
+    def __init__(self, table: core.object.table.Table, alias, outer=False):
+        self.table = table
+        self.alias = alias
+        self.outer = outer
+        self.on = []  # type: List[tuple]  # (field, field of the linked table or value)
+
+
+class Column:
+    """
+    Field of a query loaded from a field of a data item, aggregated by method
+    """
+    def __init__(self, field: Field, source: Field, method=None):
+        self.field = field
+        self.source = source
+        self.method = method
+
+
+class Query(Unit):
+    """
+    Defines a read only set of rows joining tables, selected by a single statement
+    """
+    _methods = ['SUM', 'MIN', 'MAX', 'AVG', 'COUNT']
+
+    def __init__(self):
+        super().__init__()
+        self._type = UnitType.QUERY
+        self._dataitems = []  # type: List[DataItem]
+        self._columns = []  # type: List[Column]
+        self._filterlevel = 0
+        self._filterlevelmode = {}
+        self._init()
+        self._init_check()
+
+        for col in self._columns:
+            col.field.sqlname = col.field._codename
+
+        self._currentkey = []  # type: List[Field]
+        self._ascending = True
+        self._currentrow = -1
+        self._dataset = None
+        self._pagesize = 0
+        self._offset = 0
+
+    def _dataitem(self, table, link: core.object.table.Table = None, *, field=None, outer=False):
+        """
+        Add a table to the query, returns its instance (filters are set on its fields)
+
+        table -- table to read (class)
+        link -- data item joined with, through the relation of a field to the other table
+        field -- field with the relation (codename), if more fields are related to the other table
+        outer -- keep the rows of the linked data item without matching rows
+        """
+        item = DataItem(table(), 't' + str(len(self._dataitems)), outer)
+
+        if link is not None:
+            if not self._relate(item, item.table, link, field):
+                if not self._relate(item, link, item.table, field):
+                    raise Exception(label('No relation between \'{0}\' and \'{1}\''.format(item.table._caption,
+                                                                                          link._caption)))
+        elif self._dataitems:
+            raise Exception(label('Data item \'{0}\' must be linked to a previous one'.format(item.table._caption)))
+
+        self._dataitems.append(item)
+        return item.table
+
+    @staticmethod
+    def _relate(item: DataItem, table: core.object.table.Table, to: core.object.table.Table, codename):
+        """
+        Set the join condition of the data item from the first relation of a field of table to the other table
+        """
+        for f in table._fields:
+            if (codename is not None) and (f._codename != codename):
+                continue
+
+            for rel in f._relations:
+                if not isinstance(to, rel['to']):
+                    continue
+
+                item.on.append((f, getattr(to, rel['field'])))
+                if rel['when']:
+                    for w in rel['when']:
+                        item.on.append((getattr(table, w), rel['when'][w]))
+                return True
+
+        return False
+
+    def _column(self, source: Field, method=None):
+        """
+        Add a column loaded from a field of a data item, returns the field of the query
+        With method (SUM, MIN, MAX, AVG, COUNT) the rows are grouped by the columns without method
+        """
+        if (method is not None) and (method not in self._methods):
+            raise Exception(label('Invalid method \'{0}\''.format(method)))
+
+        # bit columns cannot be aggregated by SQL Server
+        if (method is not None) and (method != 'COUNT') and (source.type == FieldType.BOOLEAN):
+            raise Exception(label('Field \'{0}\' is boolean and cannot be aggregated'.format(source.caption)))
+
+        if not any(item.table is source._parent for item in self._dataitems):
+            raise Exception(label('Field \'{0}\' is not part of a data item'.format(source.caption)))
+
+        if method == 'COUNT':
+            field = Integer(source.name, source.caption)
+        else:
+            field = copy.copy(source)
+            field.filters = []
+
+        self._columns.append(Column(field, source, method))
+        return field
+
+    def setcurrentkey(self, *fields):
+        """
+        Set the columns to sort by
+        """
+        self._currentkey = list(fields)
+
+    def ascending(self, value: bool):
+        """
+        Set ascending or descending sorting
+        """
+        self._ascending = value
+
+    def setfilterlevel(self, level, or_mode=False):
+        """
+        Set filter level for new filters added to columns
+        """
+        self._filterlevel = level
+        if or_mode:
+            self._filterlevelmode[level] = 'OR'
+
+    def reset(self):
+        """
+        Remove filters from columns and data items and reset sorting
+        """
+        self._currentkey = []
+        self._ascending = True
+        for f in self._fields:
+            f.filters.clear()
+        for item in self._dataitems:
+            item.table.reset()
+
+    def findset(self, stream=False, size_hint=None):
+        """
+        Select a set of rows based on current sorting and filters
+        With stream the rows are fetched from a single query as read goes on
+        size_hint is the expected number of rows, used as size of the first set
+        """
+        db = core.session.Session.database
+        size = None
+        if size_hint is not None:
+            size = max(1, min(size_hint, db.dataset_maxsize))
+
+        self._pagesize = size if size is not None else db.dataset_size
+        self._offset = 0
+        self._dataset = db.query_findset(self, size=size, stream=stream)
+        self._currentrow = -1
+        if len(self._dataset) > 0:
+            return True
+        else:
+            return False
+
+    def read(self):
+        """
+        Read one row from dataset, if none returns false
+        """
+        self._currentrow += 1
+        if self._currentrow >= len(self._dataset):
+            self._currentrow = 0
+            self._offset += len(self._dataset)
+            self._pagesize = core.session.Session.database.dataset_nextsize(self._pagesize)
+            self._dataset = core.session.Session.database.query_nextset(self, self._pagesize)
+            if len(self._dataset) == 0:
+                return False
+
+        core.session.Session.database.query_loadrow(self, self._dataset, self._currentrow)
+        return True
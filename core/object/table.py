@@ -1,7 +1,7 @@
 from typing import Dict, List
 from core.object.unit import Unit
 from core.object.unit import UnitType
-from core.field.field import Field
+from core.field.field import Field, FieldType
 from core.utility.convert import Convert
 from core.utility.proxy import Proxy
 from core.language import label
@@ -17,17 +17,25 @@ class Table(Unit):
         self._type = UnitType.TABLE
         self._primarykey = []  # type: List[Field]
         self._dropdown = []  # type: List[Field]
-        self._indexes = {}  # type: Dict[str, List[Field]]
+        self._indexes = {}  # type: Dict[str, dict]
+        self._loadfields = []  # type: List[Field]
+        self._pkcache = False
+        self._pkcache_validate = False
+        self._cached = False
         self._init()
         self._init_check()
         
         self._currentkey = []  # type: List[Field]
         self._ascending = True
         self._locktable = False
+        self._buffered = False
 
         self._currentrow = -1
         self._dataset = None
+        self._pagesize = 0
+        self._prefetch = False
         self._rowversion = None
+        self._partial = False
         self._sqlname = Convert.to_sqlname(self._name)
         self._filterlevel = 0
         self._filterlevelmode = {}
@@ -72,6 +80,29 @@ class Table(Unit):
             if field not in self._currentkey:
                 self._currentkey.append(field)
 
+    def setloadfields(self, *fields):
+        """
+        Load only the specified fields (plus primary key and current key), without fields load all
+        """
+        self._loadfields.clear()
+
+        for field in fields:
+            self._loadfields.append(field)
+
+    def _getloadfields(self):
+        """
+        Returns the fields to load from the database
+        """
+        if not self._loadfields:
+            return self._fields
+
+        res = []
+        for field in self._fields:
+            if (field in self._loadfields) or (field in self._primarykey) or (field in self._currentkey):
+                res.append(field)
+
+        return res
+
     def _setprimarykey(self, *fields):
         """
         Set the primary key of the table
@@ -88,19 +119,26 @@ class Table(Unit):
         for field in fields:
             self._dropdown.append(field)
 
-    def _addindex(self, name, *fields):
+    def _addindex(self, name, *fields, include=None, unique=False):
         """
         Define a new index for the table
-        """
-        self._indexes[name] = []
-        for field in fields:
-            self._indexes[name].append(field)
+        
+        fields -- key fields of the index
+        include -- additional fields stored in the index (list)
+        unique -- index values must be unique
+        """
+        self._indexes[name] = {
+            'fields': list(fields),
+            'include': list(include) if include else [],
+            'unique': unique
+        }
         
     def init(self):
         """
         Initialize all fields
         """
         self._rowversion = None
+        self._partial = False
         for field in self._fields:
             field.init()
 
@@ -115,12 +153,34 @@ class Table(Unit):
         """
         Insert the record
         """
+        if self._partial:
+            self._error_partial()
+
         if run_trigger:
             self._oninsert()
 
-        core.session.Session.database.table_insert(self)
+        if self._buffered:
+            core.session.Session.database.buffer_insert(self)
+        else:
+            core.session.Session.database.flush(self)
+            core.session.Session.database.table_insert(self)
+        core.session.Session.database.cache_invalidate(self, self.getposition())
         self._accept_changes()
 
+    def insertall(self, records, run_trigger=False):
+        """
+        Insert a list of records of this table in batches
+        """
+        if run_trigger:
+            for rec in records:
+                rec._oninsert()
+
+        core.session.Session.database.flush(self)
+        core.session.Session.database.table_insertall(self, records)
+        core.session.Session.database.cache_invalidate(self)
+        for rec in records:
+            rec._accept_changes()
+
     def _oninsert(self):
         """
         Event before insertion
@@ -130,10 +190,18 @@ class Table(Unit):
         """
         Modify the record
         """
+        if self._partial:
+            self._error_partial()
+
         if run_trigger:
             self._onmodify()
 
-        core.session.Session.database.table_modify(self)
+        if self._buffered:
+            core.session.Session.database.buffer_modify(self)
+        else:
+            core.session.Session.database.flush(self)
+            core.session.Session.database.table_modify(self)
+        core.session.Session.database.cache_invalidate(self, self.getposition())
         self._accept_changes()
 
     def _onmodify(self):
@@ -147,6 +215,13 @@ class Table(Unit):
         """
         self._locktable = lock
 
+    def buffered(self, value=True):
+        """
+        Collect insert and modify of the records in the write buffer of the transaction, written in batches
+        before commit or before the next statement on the table
+        """
+        self._buffered = value
+
     def delete(self, run_trigger=False):
         """
         Delete the record
@@ -154,30 +229,129 @@ class Table(Unit):
         if run_trigger:
             self._ondelete()
 
+        core.session.Session.database.flush(self)
         core.session.Session.database.table_delete(self)
+        core.session.Session.database.cache_invalidate(self, self.getposition())
 
-    def deleteall(self, run_trigger=False):
+    def deleteall(self, run_trigger=False, batch=False):
         """
         Delete all record matching the current filter
+        With batch the triggers run for a whole dataset page, then the page is deleted at once
         """
-        if run_trigger:
+        if run_trigger and batch:
+            if self.findset():
+                rows = []
+                while self.read():
+                    self._ondelete()
+                    rows.append((self.getposition(), self._rowversion))
+                    if self._currentrow >= len(self._dataset) - 1:
+                        self._deleterows(rows)
+                        rows = []
+
+                self._deleterows(rows)
+
+        elif run_trigger:
             if self.findset():
                 while self.read():
                     self.delete(True)
 
         else:
+            core.session.Session.database.flush(self)
             core.session.Session.database.table_deleteall(self)
+            core.session.Session.database.cache_invalidate(self)
+
+    def modifyall(self, field: Field, value, run_trigger=False):
+        """
+        Set the field to the value in all records matching the current filter
+        """
+        if field in self._primarykey:
+            raise Exception(label('Field \'{0}\' is part of primary key, use rename'.format(field.caption)))
+
+        value = field.checkvalue(value)
+
+        if run_trigger:
+            # read by primary key (never modified), so a modified record cannot be read again later in
+            # the sorting, and modify a copy to keep the keyset of the dataset unchanged
+            currentkey = list(self._currentkey)
+            ascending = self._ascending
+            self.setcurrentkey()
+            self._ascending = True
+            try:
+                rec = self.__class__()
+                rec._buffered = self._buffered
+                index = self._fields.index(field)
+                if self.findset():
+                    while self.read():
+                        rec._transfer(self)
+                        rec._fields[index].value = value
+                        rec.modify(True)
+            finally:
+                self.setcurrentkey(*currentkey)
+                self._ascending = ascending
+
+        else:
+            core.session.Session.database.flush(self)
+            core.session.Session.database.table_modifyall(self, field, value)
+            core.session.Session.database.cache_invalidate(self)
+
+    def _transfer(self, source):
+        """
+        Copy the loaded record of another instance of the same table
+        """
+        for field, other in zip(self._fields, source._fields):
+            field._load(other.value)
+
+        self._rowversion = source._rowversion
+        self._partial = source._partial
+
+    def _clone(self):
+        """
+        Returns a new instance with the values (current and loaded) of the record
+        """
+        rec = self.__class__()
+        for field, other in zip(rec._fields, self._fields):
+            field.__dict__['value'] = other.value
+            field.__dict__['xvalue'] = other.xvalue
+
+        rec._rowversion = self._rowversion
+        return rec
+
+    def _deleterows(self, rows):
+        """
+        Delete records by a list of (primary key, rowversion), delete triggers are not called
+        """
+        if rows:
+            core.session.Session.database.flush(self)
+            core.session.Session.database.table_deleterows(self, rows)
+            for pk, rowversion in rows:
+                core.session.Session.database.cache_invalidate(self, pk)
 
     def _ondelete(self):
         """
         Event before deletion
         """
 
-    def _error_concurrency(self):
+    def _error_concurrency(self, rows=None):
+        """
+        Concurrency error, on the record or on a list of primary keys
+        """
+        if rows is None:
+            rows = [[f.value for f in self._primarykey]]
+        pk = '; '.join([', '.join([str(v) for v in row]) for row in rows])
+        raise Exception(label('Another user has modified \'{0}\' ({1}), restart the activity'.format(self._caption, pk)))
+
+    def _error_duplicate(self):
         """
-        Concurrency error
+        Duplicate primary key error
         """
-        raise Exception(label('Another user has modified \'{0}\', restart the activity'.format(self._caption)))
+        pk = ', '.join([str(f.value) for f in self._primarykey])
+        raise Exception(label('Record of \'{0}\' ({1}) already exists'.format(self._caption, pk)))
+
+    def _error_partial(self):
+        """
+        Partially loaded record error
+        """
+        raise Exception(label('Record of \'{0}\' is partially loaded (setloadfields), reload it before writing'.format(self._caption)))
 
     def _error_noprimarykey(self):
         """
@@ -191,17 +365,29 @@ class Table(Unit):
         """
         raise Exception('FIXME')
 
-    def findset(self):
+    def findset(self, stream=False, size_hint=None, prefetch=False):
         """
         Select a set of rows based on current key and filters
+        With stream the rows are fetched from a single query as read goes on
+        size_hint is the expected number of rows, used as size of the first set
+        With prefetch the next set is read on a second connection while the current one is processed
         """
-        return self._findset()
+        size = None
+        if size_hint is not None:
+            size = max(1, min(size_hint, core.session.Session.database.dataset_maxsize))
 
-    def _findset(self, size=None, offset=None):
+        # locks must be taken by the connection of the session
+        self._prefetch = prefetch and (not stream) and (not self._locktable)
+        res = self._findset(size=size, stream=stream)
+        self._prefetchnext()
+        return res
+
+    def _findset(self, size=None, offset=None, stream=False):
         """
         Select a set of rows based on current key and filters (with pagination)
         """
-        self._dataset = core.session.Session.database.table_findset(self, size=size, offset=offset)
+        self._pagesize = size if size is not None else core.session.Session.database.dataset_size
+        self._dataset = core.session.Session.database.table_findset(self, size=size, offset=offset, stream=stream)
         self._currentrow = -1
         if len(self._dataset) > 0:
             return True
@@ -223,20 +409,75 @@ class Table(Unit):
         self._currentrow += 1
         if self._currentrow >= len(self._dataset):
             self._currentrow = 0
-            self._dataset = core.session.Session.database.table_nextset(self)
+            self._pagesize = self._nextpagesize()
+            self._dataset = core.session.Session.database.table_nextset(self, self._pagesize)
             if len(self._dataset) == 0:
                 return False
+            self._prefetchnext()
 
-        core.session.Session.database.table_loadrow(self, self._dataset[self._currentrow])
-        self._accept_changes()
+        core.session.Session.database.table_loadrow(self, self._dataset, self._currentrow)
         return True
 
+    def _nextpagesize(self):
+        """
+        Size of the next set: grows geometrically up to dataset_maxsize as the read loop goes on
+        """
+        return core.session.Session.database.dataset_nextsize(self._pagesize)
+
+    def _prefetchnext(self):
+        """
+        Read ahead the next set if the current one is full
+        """
+        if self._prefetch and (len(self._dataset) >= self._pagesize):
+            core.session.Session.database.table_prefetch(self, self._nextpagesize())
+
     def count(self):
         """
         Returns the total number of rows
         """
         return core.session.Session.database.table_count(self)
 
+    def calcsums(self, *fields):
+        """
+        Set the fields to the sum of their values on the rows matching the current filter
+        """
+        self._calcfields('SUM', fields, True)
+
+    def calcmin(self, *fields):
+        """
+        Set the fields to the minimum value on the rows matching the current filter
+        """
+        self._calcfields('MIN', fields, False)
+
+    def calcmax(self, *fields):
+        """
+        Set the fields to the maximum value on the rows matching the current filter
+        """
+        self._calcfields('MAX', fields, False)
+
+    def calcavg(self, *fields):
+        """
+        Set the fields to the average value on the rows matching the current filter
+        """
+        self._calcfields('AVG', fields, True)
+
+    def _calcfields(self, function, fields, numeric):
+        """
+        Compute an aggregate function on the database
+        """
+        if not fields:
+            return
+
+        for field in fields:
+            if numeric and (field.type not in [FieldType.INTEGER, FieldType.BIGINTEGER, FieldType.DECIMAL]):
+                raise Exception(label('Field \'{0}\' is not numeric'.format(field.caption)))
+
+            # bit columns cannot be aggregated by SQL Server
+            if field.type == FieldType.BOOLEAN:
+                raise Exception(label('Field \'{0}\' is boolean and cannot be aggregated'.format(field.caption)))
+
+        core.session.Session.database.table_calcfields(self, function, fields)
+
     def isempty(self):
         """
         Returns true if the table is empty with current filters
@@ -105,6 +105,7 @@ def worker_loop(args):
         core.application.Application.initialize()
         core.application.Application._cli_loglevel = args['cli_loglevel']
         core.application.Application._log_lock = args['log_lock']
+        core.application.Application._cache_versions = args['cache_versions']
         
         core.application.Application.load_instance(args['instname'])
 
@@ -156,6 +157,7 @@ class Worker:
             'instname': core.application.Application.instance['name'],
             'cli_loglevel': core.application.Application._cli_loglevel,
             'log_lock': core.application.Application._log_lock,
+            'cache_versions': core.application.Application._cache_versions,
             'pipe': pipe_pair[1]
         }  
 
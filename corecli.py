@@ -50,14 +50,14 @@ def check_code(path):
     print('Source code check done.')
 
 
-def sync_schema(inst, mode):
+def sync_schema(inst, mode, parallel):
     Application.initialize()
     Application.load_instance(inst)
     Session.connect()
-    if Application.synchronize_schema():
-        print('Schema synchronization done.')    
+    if Application.synchronize_schema(mode == 'check', parallel):
+        print('Schema {0} done.'.format('check' if mode == 'check' else 'synchronization'))    
     else:
-        print('Schema synchronization done with errors.')    
+        print('Schema {0} done with errors.'.format('check' if mode == 'check' else 'synchronization'))    
 
 
 def signal_exit(sign, frame):
@@ -109,6 +109,7 @@ Copyright ahead.it 2019-2020
     parser.add_argument('--check', help='check source code', metavar='PATH')
     parser.add_argument('--sym', help='generate symbols', action='store_true')
     parser.add_argument('--schema', help='synchronize database schema', choices=['check', 'force'])
+    parser.add_argument('--parallel', help='number of connections used by schema synchronization', type=int, default=1, metavar='N')
     parser.add_argument('--instance', help='instance name')
     parser.add_argument('--log', help="show log on console", choices=['E', 'W', 'I', 'D'], nargs='+')
     parser.add_argument('--start', help='start web server', action='store_true')
@@ -136,7 +137,7 @@ Copyright ahead.it 2019-2020
         generate_symbols()
 
     elif args.schema and args.instance:
-        sync_schema(args.instance, args.schema)
+        sync_schema(args.instance, args.schema, args.parallel)
 
     elif args.start and args.instance:
         start_webserver(args.instance)